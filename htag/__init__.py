@@ -1,4 +1,4 @@
-from .core import Tag, prevent, stop, State, current_request
+from .core import Tag, prevent, stop, State, Computed, StateList, StateDict, For, current_request
 from .server import WebApp
 from .runner import ChromeApp
 import logging
@@ -7,4 +7,4 @@ import logging
 # logging won't see "No handler found" warnings.
 logging.getLogger("htag").addHandler(logging.NullHandler())
 
-__all__ = ["Tag", "ChromeApp", "prevent", "stop", "State", "WebApp"]
+__all__ = ["Tag", "ChromeApp", "prevent", "stop", "State", "Computed", "StateList", "StateDict", "For", "WebApp"]
@@ -1,21 +1,31 @@
 from __future__ import annotations
 
+import bisect
 import html
 import logging
 import threading
 import weakref
+import contextlib
 import contextvars
-from typing import Any, Callable
+from typing import Any, Callable, Hashable, Iterable, Iterator, MutableMapping
 
 
 class _HtagLocal(threading.local):
     stack: list[GTag]
-    current_eval: GTag | None  # Track which GTag is evaluating a reactive lambda
+    current_eval: GTag | Computed | None  # Track which GTag (or Computed) is evaluating a reactive lambda
+    current_deps: dict[State, int] | None  # States (-> versions) read by the reactive lambda being evaluated
+    volatile: bool  # The render in progress includes output that can't be cached
+    batch_depth: int  # Nesting level of State.batch()
+    batched: dict[State, None]  # States changed in the current batch (ordered set)
 
     def __init__(self) -> None:
         super().__init__()
         self.stack = []
         self.current_eval = None
+        self.current_deps = None
+        self.volatile = False
+        self.batch_depth = 0
+        self.batched = {}
 
 
 _ctx = _HtagLocal()
@@ -76,23 +86,53 @@ def _scope_css(css: str, scope_cls: str) -> str:
 
 
 class State:
-    def __init__(self, value: Any):
+    """
+    A reactive value. Assigning `value` notifies the observers if it has changed,
+    according to the `policy`:
+    - "equality" (default): the new value is not `==` to the old one (values whose
+      comparison is ambiguous, like arrays, are considered changed)
+    - "identity": the new value is another object (no comparison cost, for big values)
+    - a callable `(old, new) -> bool`, returning True if the values are the same
+    """
+
+    def __init__(self, value: Any, policy: str | Callable[[Any, Any], bool] = "equality"):
+        if not callable(policy) and policy not in ("equality", "identity"):
+            raise ValueError(f"Unknown State policy: {policy!r}")
         self._value = value
-        self._observers: weakref.WeakSet["GTag"] = weakref.WeakSet()
+        self._version = 0  # Incremented on each notification
+        self._observers: weakref.WeakSet[GTag | Computed] = weakref.WeakSet()
+        self.policy = policy
+
+    @property
+    def version(self) -> int:
+        """Incremented on each change (or notification): a cheap way to detect changes."""
+        return self._version
 
     @property
     def value(self) -> Any:
-        # If a GTag is currently evaluating a reactive function, it records itself as an observer
+        # If a GTag (or a Computed) is currently evaluating a reactive function, it records itself as an observer
         if _ctx.current_eval is not None:
             self._observers.add(_ctx.current_eval)
+            if _ctx.current_deps is not None:
+                _ctx.current_deps.setdefault(self, self._version)
         return self._value
 
     @value.setter
     def value(self, new_value: Any) -> None:
-        if self._value != new_value:
+        if not self._same(self._value, new_value):
             self._value = new_value
             self._notify_observers()
 
+    def _same(self, old: Any, new: Any) -> bool:
+        """Whether a new value is the same as the old one, according to the policy."""
+        if old is new:
+            return True
+        if self.policy == "identity":
+            return False
+        if self.policy == "equality":
+            return _same_value(old, new)
+        return bool(self.policy(old, new))  # type: ignore
+
     def set(self, value: Any) -> Any:
         self.value = value
         return value
@@ -101,10 +141,342 @@ class State:
         """Force notification after in-place mutation of mutable values (lists, dicts)."""
         self._notify_observers()
 
+    @staticmethod
+    @contextlib.contextmanager
+    def batch() -> Iterator[None]:
+        """
+        Defers the notifications of the States changed in the block (or in the decorated
+        function) until the outermost batch exits, then notifies each observer only once:
+
+            with State.batch():
+                self.bid.value = 10
+                self.ask.value = 11
+
+        (Batches are per thread: don't `await` inside a batch)
+        """
+        _ctx.batch_depth += 1
+        try:
+            yield
+        finally:
+            _ctx.batch_depth -= 1
+            if _ctx.batch_depth == 0 and _ctx.batched:
+                states, _ctx.batched = _ctx.batched, {}
+                observers: dict[GTag | Computed, None] = {}
+                for state in states:
+                    observers.update(dict.fromkeys(state._observers))
+                for observer in observers:
+                    observer._mark_stale()
+
     def _notify_observers(self) -> None:
+        self._version += 1
+        if _ctx.batch_depth:
+            _ctx.batched[self] = None  # Observers are notified at the end of the batch
+            return
         for observer in self._observers:
-            observer._GTag__dirty = True
+            observer._mark_stale()
+
+
+class Computed(State):
+    """
+    A State derived from other States, read-only:
+
+        self.total = Computed(lambda: sum(row["price"] for row in self.rows.value))
 
+    `fn` is evaluated lazily (when the value is read), tracking the States it reads (like
+    reactive lambdas do), and its result is cached until one of them changes.
+    While observed, it's recomputed as soon as an input changes, and its own observers
+    are notified only if the derived value actually differs (according to the `policy`).
+    """
+
+    def __init__(self, fn: Callable[[], Any], policy: str | Callable[[Any, Any], bool] = "equality") -> None:
+        super().__init__(None, policy)
+        self.fn = fn
+        self._deps: dict[State, int] = {}  # States read by the last evaluation
+        self._stale = True
+
+    @property
+    def value(self) -> Any:
+        if self._stale:
+            self._compute()
+        return super().value
+
+    @value.setter
+    def value(self, new_value: Any) -> None:
+        raise AttributeError("A Computed is read-only")
+
+    def _compute(self) -> bool:
+        """Evaluates `fn` (tracking the States it reads), returns True if the value changed."""
+        old_eval, old_deps = _ctx.current_eval, _ctx.current_deps
+        _ctx.current_eval = self
+        deps: dict[State, int] = {}
+        _ctx.current_deps = deps
+        try:
+            value = self.fn()
+        finally:
+            _ctx.current_eval, _ctx.current_deps = old_eval, old_deps
+        for state in self._deps:
+            if state not in deps:
+                state._observers.discard(self)
+        self._deps = deps
+        self._stale = False
+        changed = not self._same(self._value, value)
+        self._value = value
+        return changed
+
+    def _mark_stale(self) -> None:
+        """Called when a State read by `fn` has changed."""
+        self._stale = True
+        if not len(self._observers):
+            return  # Not observed: recomputed when read
+        try:
+            changed = self._compute()
+        except Exception:  # noqa: BLE001 (any error of `fn`)
+            changed = True  # The observers will get the error when reading the value
+        if changed:
+            self._notify_observers()
+
+
+class _Collection(State):
+    """
+    Base of the reactive collections: a State whose in-place mutations are made through
+    methods, which notify the observers and record their operations in a log
+    (so that renderers can apply the changes incrementally, see `ops_since`).
+    """
+
+    max_ops = 1000  # Operations kept in the log
+
+    def __init__(self, value: Any, policy: str | Callable[[Any, Any], bool] = "equality") -> None:
+        super().__init__(value, policy)
+        self._ops: list[tuple[int, tuple[Any, ...]]] = []  # (version, operation)
+        self._ops_base = 0  # The log holds all the operations after this version
+
+    def ops_since(self, version: int) -> list[tuple[Any, ...]] | None:
+        """
+        The operations made since `version`, in order (empty if it's the current version).
+        Returns None when they aren't all known (the value was replaced, notified,
+        or the log was truncated): the whole value must be considered changed.
+        """
+        if version < self._ops_base:
+            return None
+        return [op for v, op in self._ops if v > version]
+
+    def _notify_observers(self) -> None:
+        # A change not described by the log (new value, notify()): restart it
+        self._ops.clear()
+        self._ops_base = self._version + 1
+        super()._notify_observers()
+
+    def _record(self, *op: Any) -> None:
+        """Logs an operation (already applied to the value), and notifies the observers."""
+        self._ops.append((self._version + 1, op))
+        if len(self._ops) > self.max_ops:
+            version, _ = self._ops.pop(0)
+            self._ops_base = version
+        State._notify_observers(self)
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.value)
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self.value
+
+    def __getitem__(self, index: Any) -> Any:
+        return self.value[index]
+
+
+class StateList(_Collection):
+    """
+    A State holding a list, with list-like methods. Each mutation notifies the observers
+    and is logged as an operation: ("insert", index, item), ("remove", index),
+    ("set", index, item) or ("move", from_index, to_index).
+    `For` uses them to render only the changed rows.
+
+        self.messages = StateList()
+        self.messages.append("hello")
+    """
+
+    def __init__(self, items: Iterable[Any] = (), policy: str | Callable[[Any, Any], bool] = "equality") -> None:
+        super().__init__(list(items), policy)
+
+    def _index(self, index: int, insert: bool = False) -> int:
+        """Normalizes an index (as the list methods do), for the operations log."""
+        size = len(self._value)
+        if index < 0:
+            index += size
+        if insert:
+            return min(max(index, 0), size)
+        if not 0 <= index < size:
+            raise IndexError("StateList index out of range")
+        return index
+
+    def append(self, item: Any) -> None:
+        self.insert(len(self._value), item)
+
+    def extend(self, items: Iterable[Any]) -> None:
+        for item in items:
+            self.append(item)
+
+    def insert(self, index: int, item: Any) -> None:
+        index = self._index(index, insert=True)
+        self._value.insert(index, item)
+        self._record("insert", index, item)
+
+    def pop(self, index: int = -1) -> Any:
+        index = self._index(index)
+        item = self._value.pop(index)
+        self._record("remove", index)
+        return item
+
+    def remove(self, item: Any) -> None:
+        self.pop(self._value.index(item))
+
+    def move(self, index: int, to_index: int) -> None:
+        """Moves the item at `index`, so that it ends up at `to_index`."""
+        index, to_index = self._index(index), self._index(to_index)
+        if index != to_index:
+            self._value.insert(to_index, self._value.pop(index))
+            self._record("move", index, to_index)
+
+    def clear(self) -> None:
+        self.value = []
+
+    def __setitem__(self, index: int, item: Any) -> None:
+        if isinstance(index, slice):
+            new = list(self._value)
+            new[index] = item
+            self.value = new
+            return
+        index = self._index(index)
+        if not self._same(self._value[index], item):
+            self._value[index] = item
+            self._record("set", index, item)
+
+    def __delitem__(self, index: int) -> None:
+        if isinstance(index, slice):
+            new = list(self._value)
+            del new[index]
+            self.value = new
+        else:
+            self.pop(index)
+
+
+class StateDict(_Collection):
+    """
+    A State holding a dict, with dict-like methods. Each mutation notifies the observers
+    and is logged as an operation: ("set", key, value) or ("remove", key).
+    """
+
+    def __init__(self, items: Any = (), policy: str | Callable[[Any, Any], bool] = "equality") -> None:
+        super().__init__(dict(items), policy)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self.value.get(key, default)
+
+    def keys(self) -> Any:
+        return self.value.keys()
+
+    def values(self) -> Any:
+        return self.value.values()
+
+    def items(self) -> Any:
+        return self.value.items()
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        if key not in self._value or not self._same(self._value[key], value):
+            self._value[key] = value
+            self._record("set", key, value)
+
+    def __delitem__(self, key: Any) -> None:
+        del self._value[key]
+        self._record("remove", key)
+
+    def pop(self, key: Any, *default: Any) -> Any:
+        if key not in self._value and default:
+            return default[0]
+        value = self._value[key]
+        del self[key]
+        return value
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self) -> None:
+        self.value = {}
+
+
+class _TreeIndex:
+    """
+    Bookkeeping of a mounted tree, owned by its root (the App):
+    - a weak id -> GTag index (for event dispatching)
+    - the tags with pending updates (dirty or with JS calls), in registration order
+    - the statics brought by the tags mounted since the last collection
+    """
+
+    def __init__(self) -> None:
+        self.tags: weakref.WeakValueDictionary[str, GTag] = weakref.WeakValueDictionary()
+        self.pending: weakref.WeakKeyDictionary[GTag, None] = weakref.WeakKeyDictionary()
+        self.statics: set[str] = set()  # Statics already collected
+        self.new_statics: list[str] = []  # Statics not collected yet (see take_statics)
+        self.on_pending: Callable[[], None] | None = None  # Called when a tag gets pending
+
+    def register(self, tag: GTag) -> None:
+        for t in tag._iter_tree():
+            self.tags[t.id] = t
+            t._GTag__html = None  # Rendered detached (without region markers)
+            if t.is_dirty or t._GTag__js_calls:
+                self.pending[t] = None
+            self.add_statics(t)
+        if self.pending and self.on_pending is not None:
+            self.on_pending()
+
+    def add_statics(self, tag: GTag) -> None:
+        """Records the statics of a tag (of its class, then its own) that are new."""
+        for s_list in (getattr(tag.__class__, "statics", []), getattr(tag, "statics", [])):
+            if not isinstance(s_list, (list, tuple)):
+                s_list = [s_list]
+            for s in s_list:
+                s_str = str(s)
+                if s_str not in self.statics:
+                    self.statics.add(s_str)
+                    self.new_statics.append(s_str)
+
+    def take_statics(self) -> list[str]:
+        """The new statics, since the last call."""
+        new_statics, self.new_statics = self.new_statics, []
+        return new_statics
+
+    def reset_statics(self, statics: list[str]) -> None:
+        """Restarts the tracking from the statics of the whole tree (see `App._render_page`)."""
+        self.statics = set(statics)
+        self.new_statics = []
+
+    def unregister(self, tag: GTag) -> None:
+        for t in tag._iter_tree():
+            if self.tags.get(t.id) is t:
+                del self.tags[t.id]
+            t._GTag__html = None  # Rendered attached (with region markers)
+
+
+# The last rendered state of a tag: (tag name, attributes, content), where the content is
+# a list of (child tag, html) for the child tags, and (None, html) for the other pieces
+Snapshot = tuple[str, dict[str, str], list[tuple["GTag | None", str]]]
+
+# Operations of the (non-recursive) renderer's work stack
+_ITEM, _OPEN, _CLOSE, _TEXT = 0, 1, 2, 3
+
+# Elements whose content is raw text: comments (region markers) can't be used inside
+RAW_TEXT_ELEMENTS: set[str] = {"script", "style", "textarea", "title"}
+
+# Elements whose content is rendered (and updated) as a whole: the raw text ones, and the ones
+# whose content is reshaped by the HTML parser (a <tr> right in a <table> gets an implied <tbody>)
+WHOLE_CONTENT_ELEMENTS: set[str] = RAW_TEXT_ELEMENTS | {"table"}
+
+# Over this number of structural changes, a tag is rendered as a whole
+MAX_CHILD_OPS = 500
 
 VOID_ELEMENTS: set[str] = {
     "area",
@@ -133,6 +505,10 @@ class GTag:  # aka "Generic Tag"
         Renders the HTML attributes and events of the tag.
         Handles boolean attributes (True -> key only, False -> omit).
         """
+        # Auto-inject oninput for inputs if not already there, to support auto-binding
+        if self.tag in ("input", "textarea", "select") and "input" not in self.__events:
+            self.__attrs["oninput"] = f"htag_event('{self.id}', 'input', event)"
+
         attrs_list: list[str] = []
         for k, v in self.__attrs.items():
             attr_name = k.replace("_", "-")
@@ -140,21 +516,12 @@ class GTag:  # aka "Generic Tag"
 
             if val is True:
                 attrs_list.append(attr_name)
-            elif val is False or val is None:
-                continue
-            else:
+            elif val is not False and val is not None:
                 attrs_list.append(f'{attr_name}="{html.escape(str(val))}"')
 
         for name, callback in self.__events.items():
-            if isinstance(callback, str):
-                attrs_list.append(f'on{name}="{html.escape(callback)}"')
-            else:
-                js = f"htag_event('{self.id}', '{name}', event)"
-                if getattr(callback, "_htag_prevent", False):
-                    js = f"event.preventDefault(); {js}"
-                if getattr(callback, "_htag_stop", False):
-                    js = f"event.stopPropagation(); {js}"
-                attrs_list.append(f'on{name}="{js}"')
+            js = self._event_js(name, callback)
+            attrs_list.append(f'on{name}="{html.escape(js) if isinstance(callback, str) else js}"')
 
         attrs = " ".join(attrs_list)
         if attrs:
@@ -162,6 +529,41 @@ class GTag:  # aka "Generic Tag"
         attrs += f' id="{self.id}"'
         return attrs
 
+    def _attr_value(self, value: Any) -> str | None:
+        """
+        The value of an attribute, as in the DOM: None to omit it, "" for a boolean
+        attribute (the same as an empty value).
+        """
+        val = self._eval_child(value, stringify=False)
+        if val is True:
+            return ""
+        if val is False or val is None:
+            return None
+        return str(val)
+
+    def _attrs_dict(self) -> dict[str, str]:
+        """The rendered attributes (and events) of the tag: name -> value ("" for a boolean attribute)."""
+        attrs: dict[str, str] = {}
+        for k, v in self.__attrs.items():
+            val = self._attr_value(v)
+            if val is not None:
+                attrs[k.replace("_", "-")] = val
+        for name, callback in self.__events.items():
+            attrs[f"on{name}"] = self._event_js(name, callback)
+        attrs["id"] = self.id
+        return attrs
+
+    def _event_js(self, name: str, callback: Callable | str) -> str:
+        """The JS code of an event attribute (calling the python callback through the bridge)."""
+        if isinstance(callback, str):
+            return callback
+        js = f"htag_event('{self.id}', '{name}', event)"
+        if getattr(callback, "_htag_prevent", False):
+            js = f"event.preventDefault(); {js}"
+        if getattr(callback, "_htag_stop", False):
+            js = f"event.stopPropagation(); {js}"
+        return js
+
     def __enter__(self) -> GTag:
         _ctx.stack.append(self)
         return self
@@ -181,11 +583,17 @@ class GTag:  # aka "Generic Tag"
         - kwargs: HTML attributes (prefixed with '_') or events (prefixed with 'on').
         """
         self.__lock = threading.RLock()
+        self.__html: str | None = None  # Cached HTML of the last render
         self.__attrs: dict[str, Any] = {}
         self.__events: dict[str, Callable | str] = {}
         self.__dirty = False
+        self.__full = False  # Dirty for other reasons than States read by its reactive children
+        self.__child_ops: list[tuple[Any, ...]] = []  # Structural changes since the last render
+        self.__attr_changes: set[tuple[bool, str]] = set()  # (is event, name) changed since the last render
         self.__js_calls: list[str] = []
         self.__rendered_callables: dict[Callable, list[GTag]] = {}
+        self.__memo: dict[Callable, tuple[dict[State, int], Any]] = {}  # callable -> (deps, result)
+        self.__index: _TreeIndex | None = None
 
         # Public properties for tree traversal
         self.childs: list[str | GTag | Callable] = []
@@ -203,6 +611,11 @@ class GTag:  # aka "Generic Tag"
         self.id = f"{self.tag}-{id(self)}"
         logger.debug("Created Tag: %s (id: %s)", self.tag, self.id)
 
+        # Only the root (the App) owns an index of its mounted tree
+        if isinstance(self, Tag.App):
+            self.__index = _TreeIndex()
+            self.__index.register(self)
+
         # Scoped style: auto-prefix CSS rules with a unique class per component class
         cls = self.__class__
         style_css: str | None = getattr(cls, "styles", None)
@@ -243,6 +656,8 @@ class GTag:  # aka "Generic Tag"
                     existing_statics = []
                 setattr(cls, "statics", list(existing_statics) + [style_tag])
                 setattr(cls, "_scoped_static", True)
+                if self.__index is not None:  # (the App: already registered)
+                    self.__index.add_statics(self)
 
         if _ctx.stack:
             _ctx.stack[-1].add(self)
@@ -261,22 +676,12 @@ class GTag:  # aka "Generic Tag"
         pass
 
     def _trigger_mount(self) -> None:
-        self.on_mount()
-        for child in self.childs:
-            if isinstance(child, GTag):
-                child._trigger_mount()
-        for tag_list in self.__rendered_callables.values():
-            for t in tag_list:
-                t._trigger_mount()
+        for t in self._iter_tree():
+            t.on_mount()
 
     def _trigger_unmount(self) -> None:
-        self.on_unmount()
-        for child in self.childs:
-            if isinstance(child, GTag):
-                child._trigger_unmount()
-        for tag_list in self.__rendered_callables.values():
-            for t in tag_list:
-                t._trigger_unmount()
+        for t in self._iter_tree():
+            t.on_unmount()
 
     def add(self, *content: Any) -> "GTag":
         for item in content:
@@ -293,15 +698,18 @@ class GTag:  # aka "Generic Tag"
                     if isinstance(item, GTag):
                         if item in self.childs:
                             self.childs.remove(item)
+                            self._log_child_op("remove", item)
                         item.parent = self
-                        if self.root is not None:
+                        index = self._get_index()
+                        if index is not None:
+                            index.register(item)
                             item._trigger_mount()
                     elif callable(item):
                         # Reactive function (lambda), will be evaluated on render
-                        pass
+                        self.__dirty = True
 
                     self.childs.append(item)
-                    self.__dirty = True
+                    self._log_child_op("append", item)
         return self
 
     def __iadd__(self, other: Any) -> "GTag":
@@ -318,22 +726,40 @@ class GTag:  # aka "Generic Tag"
         - Attributes starting with 'on' are treated as event callbacks.
         - Setting an HTML attribute or event marks the tag as 'dirty' for client-side update.
         """
-        if name.startswith("_GTag__") or name in ("childs", "parent", "tag", "id"):
+        if name == "id" and "id" in self.__dict__:
+            # Re-key the tag in the App index when its id is changed after mounting
+            index = self._get_index()
+            if index is not None and index.tags.get(self.id) is self:
+                del index.tags[self.id]
+                index.tags[value] = self
+            super().__setattr__(name, value)
+            self._invalidate()
+        elif name.startswith("_GTag__") or name in ("childs", "parent", "tag", "id"):
             super().__setattr__(name, value)
+            if name == "_GTag__dirty" and value:
+                self.__full = True
+                self._mark_pending()
+                self._invalidate()
+            elif name == "tag":
+                self._invalidate()
         elif name.startswith("_on") and (callable(value) or isinstance(value, str)):
             # Event (e.g., self._onclick = my_callback or self._onclick = "alert(1)")
             with self.__lock:
                 self.__events[name[3:]] = value
-                self.__dirty = True
+                self._log_attr_change(True, name[3:])
         elif name.startswith("_"):
             # HTML attribute (e.g., self._class = "foo")
             attr_name = name[1:]
             with self.__lock:
                 self.__attrs[attr_name] = value
-                self.__dirty = True
+                self._log_attr_change(False, attr_name)
         else:
             # Regular Python attribute
             super().__setattr__(name, value)
+            if name == "statics":
+                index = self._get_index()
+                if index is not None:
+                    index.add_statics(self)
 
     def __getattr__(self, name: str) -> Any:
         if name.startswith("_") and name[1:] in self.__attrs:
@@ -353,13 +779,24 @@ class GTag:  # aka "Generic Tag"
     def remove(self, item: str | GTag | Callable) -> GTag:
         with self.__lock:
             if item in self.childs:
+                index = self._get_index()
                 if isinstance(item, GTag):
-                    if self.root is not None:
+                    if index is not None:
                         item._trigger_unmount()
+                        index.unregister(item)
+                elif callable(item):
+                    memo = self.__memo.pop(item, None)
+                    if memo is not None:
+                        self._unsubscribe(memo[0])
+                    for t in self.__rendered_callables.pop(item, []):
+                        if index is not None:
+                            index.unregister(t)
                 self.childs.remove(item)
                 if isinstance(item, GTag):
                     item.parent = None
-                self.__dirty = True
+                    self._log_child_op("remove", item)
+                else:
+                    self.__dirty = True
         return self
 
     def remove_self(self) -> "GTag":
@@ -369,13 +806,99 @@ class GTag:  # aka "Generic Tag"
 
     @property
     def root(self) -> GTag | None:
+        app_class = Tag.App
         current: GTag | None = self
         while current is not None:
-            if isinstance(current, Tag.App):
+            if isinstance(current, app_class):
                 return current
             current = current.parent
         return None
 
+    def _get_index(self) -> _TreeIndex | None:
+        """Return the id index of the App this tag is mounted in (None if detached)."""
+        current: GTag | None = self
+        while current is not None:
+            if current.__index is not None:  # Only Apps own an index
+                return current.__index
+            current = current.parent
+        return None
+
+    def _invalidate(self) -> None:
+        """Drop the cached HTML of this tag, and of its ancestors (which embed it)."""
+        self.__html = None
+        current = self.parent
+        while current is not None and current.__html is not None:
+            current.__html = None
+            current = current.parent
+
+    def _mark_stale(self) -> None:
+        """Mark the tag dirty because a State read by its reactive children has changed."""
+        self._mark_partial()
+
+    def _mark_partial(self) -> None:
+        """
+        Mark the tag dirty, for changes which can be sent without rendering it as a whole
+        (stale regions, logged structural changes).
+        """
+        object.__setattr__(self, "_GTag__dirty", True)
+        self._mark_pending()
+        self._invalidate()
+
+    def _log_attr_change(self, is_event: bool, name: str) -> None:
+        """Logs the change of an attribute (or event), to be sent without rendering the whole tag."""
+        if self.__full:
+            return
+        self.__attr_changes.add((is_event, name))
+        self._mark_partial()
+
+    def _log_child_op(self, *op: Any) -> None:
+        """
+        Logs a structural change ("append", item), ("remove", tag) or ("clear",) of a mounted
+        tag, to be sent as a DOM operation instead of rendering the whole tag.
+        Otherwise (or when too many changes are logged), the tag is marked dirty as a whole.
+        The children of a void element aren't rendered: nothing to log.
+        """
+        if self.tag in VOID_ELEMENTS:
+            return
+        ops = self.__child_ops
+        if (
+            self.__full
+            or self.tag in WHOLE_CONTENT_ELEMENTS
+            or len(ops) >= MAX_CHILD_OPS
+            or self._get_index() is None
+        ):
+            self.__dirty = True
+            return
+        if op[0] == "clear":
+            self.__child_ops = [op]
+        elif op[0] == "remove" and ("append", op[1]) in ops:
+            ops.remove(("append", op[1]))  # Never sent: nothing to remove
+        else:
+            ops.append(op)
+        self._mark_partial()
+
+    def _mark_pending(self) -> None:
+        """Register this tag in its App's pending set (it's dirty or has JS calls to send)."""
+        index = self._get_index()
+        if index is not None:
+            index.pending[self] = None
+            if index.on_pending is not None:
+                index.on_pending()
+
+    def _iter_tree(self) -> Iterator[GTag]:
+        """
+        Yield this tag and all its descendants (static children, then rendered callables),
+        in document order, without recursion.
+        """
+        stack: list[GTag] = [self]
+        while stack:
+            t = stack.pop()
+            yield t
+            children = [c for c in t.childs if isinstance(c, GTag)]
+            for tag_list in t.__rendered_callables.values():
+                children.extend(tag_list)
+            stack.extend(reversed(children))
+
     @property
     def request(self) -> Any:
         """Returns the current Request/WebSocket object (if available)."""
@@ -402,14 +925,23 @@ class GTag:  # aka "Generic Tag"
 
     def clear(self) -> "GTag":
         with self.__lock:
+            index = self._get_index()
             for child in self.childs:
                 if isinstance(child, GTag):
-                    if self.root is not None:
+                    if index is not None:
                         child._trigger_unmount()
+                        index.unregister(child)
                     child.parent = None
+            if index is not None:
+                for tag_list in self.__rendered_callables.values():
+                    for t in tag_list:
+                        index.unregister(t)
             self.childs = []
             self.__rendered_callables.clear()
-            self.__dirty = True
+            states = {state for deps, _ in self.__memo.values() for state in deps}
+            self.__memo.clear()
+            self._unsubscribe(states)
+            self._log_child_op("clear")
         return self
 
     def _update_classes(self, fn: Callable[[list[str]], None]) -> "GTag":
@@ -419,7 +951,7 @@ class GTag:  # aka "Generic Tag"
             fn(classes)
             if classes != before:
                 self.__attrs["class"] = " ".join(classes)
-                self.__dirty = True
+                self._log_attr_change(False, "class")
         return self
 
     def add_class(self, name: str) -> "GTag":
@@ -438,6 +970,7 @@ class GTag:  # aka "Generic Tag"
 
     def call_js(self, script: str) -> "GTag":
         self.__js_calls.append(script)
+        self._mark_pending()
         return self
 
     # --- Public API for server-side access (avoids name-mangled access) ---
@@ -450,6 +983,48 @@ class GTag:  # aka "Generic Tag"
     def _reset_dirty(self) -> None:
         """Clear the dirty flag after rendering."""
         self.__dirty = False
+        self.__full = False
+        self.__child_ops = []
+        self.__attr_changes = set()
+
+    def _get_child_ops(self) -> list[tuple[Any, ...]]:
+        """Return the structural changes logged since the last render (see `_log_child_op`)."""
+        return self.__child_ops
+
+    def _is_stale(self, child: Callable) -> bool:
+        """Whether a reactive callable must be evaluated again (a State it read has changed)."""
+        memo = self.__memo.get(child)
+        return memo is None or any(state._version != version for state, version in memo[0].items())
+
+    def _stale_regions(self) -> list[Callable] | None:
+        """
+        When the tag is dirty only because of logged changes (attributes, structure) or
+        States read by its reactive children, returns the children whose region
+        (their output, in the DOM) must be rendered again.
+        Returns None when the whole tag must be rendered.
+        """
+        if self.__full or self.tag in WHOLE_CONTENT_ELEMENTS:
+            return None
+        return [c for c in self.childs if callable(c) and not isinstance(c, GTag) and self._is_stale(c)]
+
+    def _changed_attrs(self) -> dict[str, str | None]:
+        """
+        The attributes changed since the last render (set, or reactive with changed States),
+        as rendered: name -> value ("" for a boolean attribute, None if removed).
+        """
+        changes: dict[str, str | None] = {}
+        for k, v in self.__attrs.items():
+            if (False, k) in self.__attr_changes or (callable(v) and self._is_stale(v)):
+                changes[k.replace("_", "-")] = self._attr_value(v)
+        for is_event, name in self.__attr_changes:
+            if is_event:
+                callback = self.__events.get(name)
+                changes[f"on{name}"] = self._event_js(name, callback) if callback is not None else None
+        return changes
+
+    def _region_id(self, child: Callable) -> str:
+        """Id of the DOM region holding the output of a reactive child (unique in this tag)."""
+        return format(id(child), "x")
 
     def _get_rendered_callables(self) -> dict[Callable, list["GTag"]]:
         """Return the dict of callable -> rendered GTag children."""
@@ -473,31 +1048,73 @@ class GTag:  # aka "Generic Tag"
         """Set an attribute directly without triggering dirty flag (for input sync)."""
         with self.__lock:
             self.__attrs[name] = value
+            self._invalidate()  # Next renders must reflect the synced value
+
+    def _eval_callable(self, child: Callable) -> Any:
+        """
+        Evaluates a reactive callable, tracking the States it reads and the GTags it produces.
+        The result is memoized: it's reused as long as none of the States it read has changed.
+        """
+        memo = self.__memo.get(child)
+        if memo is not None:
+            deps, res = memo
+            if all(state._version == version for state, version in deps.items()):
+                return res
+        previous_deps = memo[0] if memo is not None else {}
+
+        old_eval, old_deps = _ctx.current_eval, _ctx.current_deps
+        _ctx.current_eval = self
+        _ctx.current_deps = deps = {}
+        try:
+            res = child()
+        finally:
+            _ctx.current_eval, _ctx.current_deps = old_eval, old_deps
+        if deps:
+            self.__memo[child] = (deps, res)
+        else:
+            # No State to invalidate its output: it can't be memoized, nor cached in renders
+            self.__memo.pop(child, None)
+            _ctx.volatile = True
+        # States read by the previous evaluation only
+        self._unsubscribe(state for state in previous_deps if state not in deps)
+
+        # Track GTag objects generated by this callable for event dispatching
+        tags: list[GTag] = []
+        items: list[Any] = [res]
+        while items:
+            item = items.pop()
+            if isinstance(item, GTag):
+                item.parent = self
+                tags.append(item)
+            elif isinstance(item, (list, tuple)):
+                items.extend(reversed(item))
+
+        previous = self.__rendered_callables.get(child, [])
+        self.__rendered_callables[child] = tags
+
+        # Keep the App index in sync with the tags produced by this callable
+        index = self._get_index()
+        if index is not None:
+            kept = {id(t) for t in tags}
+            known = {id(t) for t in previous}
+            for t in previous:
+                if id(t) not in kept:
+                    index.unregister(t)
+            for t in tags:
+                if id(t) not in known:
+                    index.register(t)
+        return res
+
+    def _unsubscribe(self, states: Iterable[State]) -> None:
+        """Stop observing the given States, unless one of its reactive callables still reads them."""
+        for state in states:
+            if not any(state in deps for deps, _ in self.__memo.values()):
+                state._observers.discard(self)
 
     def _eval_child(self, child: Any, stringify: bool = True) -> Any:
         """Evaluates a child for rendering. If it's a callable, evaluate it recursively and track observers."""
         if callable(child):
-            old_eval = _ctx.current_eval
-            _ctx.current_eval = self
-            try:
-                res = child()
-            finally:
-                _ctx.current_eval = old_eval
-
-            # Track GTag objects generated by this callable for event dispatching
-            tags: list[GTag] = []
-
-            def collect(item: Any) -> None:
-                if isinstance(item, GTag):
-                    item.parent = self
-                    tags.append(item)
-                elif isinstance(item, (list, tuple)):
-                    for i in item:
-                        collect(i)
-
-            collect(res)
-            self.__rendered_callables[child] = tags
-
+            res = self._eval_callable(child)
             return self._eval_child(
                 res, stringify
             )  # Recursive call to handle list/tags returned
@@ -509,19 +1126,287 @@ class GTag:  # aka "Generic Tag"
             return "" if stringify else None
         return str(child) if stringify else child
 
+    def _render(
+        self,
+        out: list[str],
+        region: Callable | None = None,
+        snapshots: MutableMapping[GTag, Snapshot] | None = None,
+    ) -> None:
+        """
+        Renders the tag and its descendants into the `out` buffer, without recursion
+        (deep trees can't hit the recursion limit).
+        Each rendered tag caches its HTML until it, or one of its descendants, changes:
+        tags with a valid cache are spliced in without being re-rendered.
+        In a mounted tree, the output of each reactive child is delimited by comments
+        (`<!--htag:RID-->...<!--/htag:RID-->`): a region that can be updated on its own.
+        If `region` is given, only the output of this reactive child is rendered.
+        If `snapshots` is given, it receives the snapshot of each (re)rendered tag.
+        """
+        regions = region is not None or self._get_index() is not None
+        todo: list[tuple[int, Any, Any]] = []
+        frames: list[tuple[GTag, int, bool]] = []  # open tags: (tag, start in out, outer volatile)
+        contents: list[list[tuple[GTag | None, str]]] = []  # content of the open tags (snapshots)
+        initial_volatile = _ctx.volatile
+        try:
+            if region is None:
+                todo.append((_OPEN, self, None))
+            else:
+                todo.append((_ITEM, self._eval_callable(region), self))
+            while todo:
+                op, obj, owner = todo.pop()
+                if op == _ITEM:
+                    if isinstance(obj, GTag):
+                        todo.append((_OPEN, obj, None))
+                    elif callable(obj):
+                        if regions and owner.tag not in WHOLE_CONTENT_ELEMENTS:
+                            rid = owner._region_id(obj)
+                            out.append(f"<!--htag:{rid}-->")
+                            if contents:
+                                contents[-1].append((None, out[-1]))
+                            todo.append((_TEXT, f"<!--/htag:{rid}-->", None))
+                        todo.append((_ITEM, owner._eval_callable(obj), owner))
+                    elif isinstance(obj, (list, tuple)):
+                        todo.extend((_ITEM, i, owner) for i in reversed(obj))
+                    elif obj is not None:
+                        out.append(str(obj))
+                        if contents:
+                            contents[-1].append((None, out[-1]))
+                elif op == _OPEN:
+                    cached = obj.__html
+                    if cached is not None:
+                        out.append(cached)
+                        if contents:
+                            contents[-1].append((obj, cached))
+                        continue
+                    obj.__lock.acquire()
+                    frames.append((obj, len(out), _ctx.volatile))
+                    if snapshots is not None:
+                        contents.append([])
+                    _ctx.volatile = False
+                    todo.append((_CLOSE, obj, None))
+                    attrs = obj._render_attrs()
+                    if obj.tag in VOID_ELEMENTS:
+                        out.append(f"<{obj.tag}{attrs}/>")
+                        continue
+                    if obj.tag:
+                        out.append(f"<{obj.tag}{attrs}>")
+                    todo.extend((_ITEM, c, obj) for c in reversed(obj.childs))
+                elif op == _TEXT:
+                    out.append(obj)
+                    if contents:
+                        contents[-1].append((None, obj))
+                else:  # _CLOSE
+                    tag, start, outer_volatile = frames.pop()
+                    if tag.tag and tag.tag not in VOID_ELEMENTS:
+                        out.append(f"</{tag.tag}>")
+                    # A dirty tag (never rendered by the App, or changed while rendering) isn't cached
+                    cacheable = not _ctx.volatile and not tag.__dirty
+                    if cacheable or snapshots is not None:
+                        result = "".join(out[start:])
+                        del out[start:]
+                        out.append(result)
+                        if cacheable:
+                            tag.__html = result
+                    if snapshots is not None:
+                        snapshots[tag] = (tag.tag or "", tag._attrs_dict(), contents.pop())
+                        if contents:
+                            contents[-1].append((tag, out[-1]))
+                    # Ancestors can't cache an output embedding an uncached one
+                    _ctx.volatile = outer_volatile or not cacheable
+                    tag.__lock.release()
+        finally:
+            if frames:  # Aborted by an exception: release the locks still held
+                for tag, _, _ in reversed(frames):
+                    tag.__lock.release()
+                _ctx.volatile = initial_volatile
+
     def __str__(self) -> str:
-        """Renders the tag and its children to an HTML string."""
-        with self.__lock:
-            attrs = self._render_attrs()
-            content = "".join(str(self._eval_child(c)) for c in self.childs)
+        """Renders the tag and its children to an HTML string (see `_render`)."""
+        out: list[str] = []
+        self._render(out)
+        return out[0] if len(out) == 1 else "".join(out)
+
+    def _render_region(self, child: Callable, snapshots: MutableMapping[GTag, Snapshot] | None = None) -> str:
+        """Renders the content of the region of a reactive child (see `_render`)."""
+        volatile = _ctx.volatile
+        out: list[str] = []
+        try:
+            self._render(out, child, snapshots)
+        finally:
+            _ctx.volatile = volatile  # Nothing of this tag is cached by a region render
+        return "".join(out)
+
+
+class For:
+    """
+    Keyed list rendering, to use as a reactive child:
+
+        Tag.ul(For(self.users, lambda u: Tag.li(u["name"]), key=lambda u: u["id"]))
 
-            if self.tag in VOID_ELEMENTS:
-                return f"<{self.tag}{attrs}/>"
+    - items: a State holding an iterable, or a callable returning one.
+    - render: builds the content (usually a GTag) of a row, from an item.
+    - key: returns the (hashable) key of an item (defaults to the item itself).
 
-            if self.tag:
-                return f"<{self.tag}{attrs}>{content}</{self.tag}>"
+    Rows are reused (same GTag instances, so same ids and cached HTML) for keys whose item
+    is unchanged (same or equal value): only new or changed items are rendered again.
+    Note: in-place mutations of an item can't be detected; replace the item instead
+    (or read States through lambdas inside the row).
+
+    `changes` describes the changes of the rows since the previous evaluation, as
+    ("insert", row, next_row), ("remove", row) or ("move", row, next_row) (next_row being
+    the row it's placed before, None at the end), to apply in order. With a `StateList`,
+    the logged operations are applied to the rows, without iterating over the items;
+    otherwise they're computed by comparing the keys, before and after (the rows kept in
+    place are the longest run of rows still in the same order). `changes` is None at the
+    first evaluation, or when no row was kept.
+    """
+
+    def __init__(
+        self,
+        items: State | Callable[[], Iterable[Any]],
+        render: Callable[[Any], Any],
+        key: Callable[[Any], Hashable] | None = None,
+    ) -> None:
+        self.items = items
+        self.render = render
+        self.key = key
+        self._rows: dict[Hashable, tuple[Any, Any]] = {}  # key -> (item, rendered row)
+        self._order: list[Hashable] = []  # keys of the rows, in order
+        self._version: int | None = None  # version of the StateList of the last evaluation
+        self._built = False  # whether the rows of the last evaluation are the ones in the DOM
+        self.changes: list[tuple[Any, ...]] | None = None
+
+    def _key(self, item: Any) -> Hashable:
+        return self.key(item) if self.key is not None else item
+
+    def __call__(self) -> list[Any]:
+        items = self.items.value if isinstance(self.items, State) else self.items()
+        self.changes = None
+        version, self._version = self._version, None  # (rebuild next time, if this one fails)
+        built, self._built = self._built, False
+        if isinstance(self.items, StateList) and version is not None:
+            ops = self.items.ops_since(version)
+            if ops is not None:
+                try:
+                    self.changes = self._apply(ops)
+                except ValueError:
+                    pass  # Duplicate keys: rebuild, to raise the error consistently
+        if self.changes is None:
+            changes = self._rebuild(items)
+            self.changes = changes if built else None
+        self._built = True
+        self._version = self.items.version if isinstance(self.items, StateList) else None
+        return [self._rows[k][1] for k in self._order]
+
+    def _rebuild(self, items: Iterable[Any]) -> list[tuple[Any, ...]] | None:
+        """
+        Builds the rows of the items, returns the changes of the rows (None when no row
+        was kept: the region is better rendered again).
+        """
+        old_rows, old_order = self._rows, self._order
+        rows: dict[Hashable, tuple[Any, Any]] = {}
+        for item in items:
+            k = self._key(item)
+            if k in rows:
+                raise ValueError(f"Duplicate key in For: {k!r}")
+            previous = self._rows.get(k)
+            if previous is not None and _same_value(previous[0], item):
+                rows[k] = previous
             else:
-                return content
+                rows[k] = (item, self.render(item))
+        self._rows = rows
+        self._order = list(rows)
+
+        # The rows not reused are removed, the others are kept (or moved)
+        changes: list[tuple[Any, ...]] = []
+        old_index: dict[Hashable, int] = {}
+        for i, k in enumerate(old_order):
+            if rows.get(k) is old_rows[k]:
+                old_index[k] = i
+            else:
+                changes.append(("remove", old_rows[k][1]))
+        if old_order and not old_index:
+            return None
+        kept = _longest_increasing([old_index[k] for k in self._order if k in old_index])
+        # From the end: the rows after the current one are in place
+        next_row = None
+        for k in reversed(self._order):
+            row = rows[k][1]
+            if k not in old_index:
+                changes.append(("insert", row, next_row))
+            elif old_index[k] not in kept:
+                changes.append(("move", row, next_row))
+            next_row = row
+        return changes
+
+    def _next_row(self, index: int) -> Any:
+        return self._rows[self._order[index]][1] if index < len(self._order) else None
+
+    def _apply(self, ops: list[tuple[Any, ...]]) -> list[tuple[Any, ...]]:
+        """Applies the operations of the StateList to the rows, returns the changes of the rows."""
+        changes: list[tuple[Any, ...]] = []
+        for op in ops:
+            if op[0] == "insert":
+                _, index, item = op
+                k = self._key(item)
+                if k in self._rows:
+                    raise ValueError(f"Duplicate key in For: {k!r}")
+                self._rows[k] = (item, self.render(item))
+                self._order.insert(index, k)
+                changes.append(("insert", self._rows[k][1], self._next_row(index + 1)))
+            elif op[0] == "remove":
+                changes.append(("remove", self._rows.pop(self._order.pop(op[1]))[1]))
+            elif op[0] == "set":
+                _, index, item = op
+                old = self._order[index]
+                if _same_value(self._rows[old][0], item):
+                    continue
+                changes.append(("remove", self._rows.pop(old)[1]))
+                k = self._key(item)
+                if k in self._rows:
+                    raise ValueError(f"Duplicate key in For: {k!r}")
+                self._rows[k] = (item, self.render(item))
+                self._order[index] = k
+                changes.append(("insert", self._rows[k][1], self._next_row(index + 1)))
+            elif op[0] == "move":
+                _, index, to_index = op
+                k = self._order.pop(index)
+                self._order.insert(to_index, k)
+                changes.append(("move", self._rows[k][1], self._next_row(to_index + 1)))
+        return changes
+
+
+def _longest_increasing(values: list[int]) -> set[int]:
+    """The values of a longest increasing subsequence (patience sorting, O(n log n))."""
+    tails: list[int] = []  # tails[j]: smallest tail of an increasing subsequence of length j+1
+    indexes: list[int] = []  # ... and its index
+    previous: list[int] = [-1] * len(values)
+    for i, value in enumerate(values):
+        j = bisect.bisect_left(tails, value)
+        if j:
+            previous[i] = indexes[j - 1]
+        if j == len(tails):
+            tails.append(value)
+            indexes.append(i)
+        else:
+            tails[j] = value
+            indexes[j] = i
+    result: set[int] = set()
+    i = indexes[-1] if indexes else -1
+    while i >= 0:
+        result.add(values[i])
+        i = previous[i]
+    return result
+
+
+def _same_value(a: Any, b: Any) -> bool:
+    """Identity or equality, for values whose `==` may not return a bool (arrays, frames...)."""
+    if a is b:
+        return True
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):  # Ambiguous truth value (elementwise comparison)
+        return False
 
 
 def prevent(func: Callable) -> Callable:
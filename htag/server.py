@@ -1,14 +1,20 @@
 from __future__ import annotations
 
 import asyncio
+import contextvars
 import json
 import logging
 import os
+import pickle
 import threading
 import traceback
 import uuid
 import inspect
-from typing import Any, Callable
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Iterator, MutableMapping
 from starlette.applications import Starlette
 from starlette.websockets import WebSocket, WebSocketDisconnect
 from starlette.requests import Request
@@ -19,7 +25,9 @@ from starlette.responses import (
     Response,
     JSONResponse,
 )
-from .core import GTag, current_request
+from .core import GTag, State, Computed, For, Snapshot, WHOLE_CONTENT_ELEMENTS, current_request
+from .sessions import SessionStore
+from .workers import worker_for, run_workers
 
 logger = logging.getLogger("htag")
 
@@ -154,9 +162,22 @@ function init_ws() {
 function handle_payload(data) {
     if(data.action == "update") {
         // Apply partial DOM updates received from the server
+        if(window.HTAG_SHELL && document.readyState === "loading") {
+            // The body of the shell page must be there to be replaced
+            document.addEventListener("DOMContentLoaded", () => handle_payload(data));
+            return;
+        }
         for(var id in data.updates) {
             var el = document.getElementById(id);
-            if(el) el.outerHTML = data.updates[id];
+            // The session replaces the shell's body, or the body of a page whose session was
+            // evicted meanwhile (the initial update of a connection: the body of the App)
+            if(!el && (window.HTAG_SHELL || data.init)) el = document.body;
+            if(el) htag_replace(el, data.updates[id]);
+        }
+        window.HTAG_SHELL = false;
+        // Apply the fine-grained operations (reactive regions, rows of lists)
+        if(data.ops) {
+            for(var i=0; i<data.ops.length; i++) htag_op(data.ops[i]);
         }
         
         // Ensure overlays are still in the DOM (in case the body was replaced)
@@ -183,6 +204,13 @@ function handle_payload(data) {
             window._htag_callbacks[data.callback_id](data.result);
             delete window._htag_callbacks[data.callback_id];
         }
+        // ... or the results of several ones (payloads coalesced by the server)
+        for(var cid in (data.callbacks || {})) {
+            if(window._htag_callbacks[cid]) {
+                window._htag_callbacks[cid](data.callbacks[cid]);
+                delete window._htag_callbacks[cid];
+            }
+        }
     } else if (data.action == "error") {
         if(_error_overlay && typeof _error_overlay.show === 'function') {
             _error_overlay.show("Server Error", data.traceback);
@@ -192,6 +220,156 @@ function handle_payload(data) {
     }
 }
 
+// A reactive region is delimited by the comments <!--htag:RID--> and <!--/htag:RID-->,
+// children of the element of its owner tag
+function htag_marker(el, data) {
+    for(var node = el.firstChild; node; node = node.nextSibling) {
+        if(node.nodeType === Node.COMMENT_NODE && node.data === data) return node;
+    }
+    return null;
+}
+
+function htag_fragment(html) {
+    var tpl = document.createElement("template"); // parses any content (even <tr>, <li>...)
+    tpl.innerHTML = html;
+    return tpl.content;
+}
+
+// Where to insert in `el`: before the element `before`, else at the end of the region `rid`, else at the end
+function htag_anchor(el, rid, before) {
+    if(before) return document.getElementById(before);
+    return rid ? htag_marker(el, "/htag:" + rid) : null;
+}
+
+// Replace an element by its new render: morphed in place (window.HTAG_MORPH), or swapped
+function htag_replace(el, html) {
+    if(window.HTAG_MORPH) htag_morph(el, html); else el.outerHTML = html;
+}
+
+// Morph `el` into the element described by `html`: only the nodes which differ are touched,
+// so the others keep their DOM state (focus, selection, scroll, running css transitions...)
+function htag_morph(el, html) {
+    var target;
+    if(el.tagName === "BODY") {
+        target = new DOMParser().parseFromString(html, "text/html").body;
+    } else {
+        var tpl = document.createElement("template");
+        tpl.innerHTML = html;
+        target = tpl.content.firstElementChild;
+    }
+    if(!target || target.tagName !== el.tagName) { el.outerHTML = html; return; }
+    htag_morph_node(el, target);
+}
+
+function htag_morph_node(from, to) {
+    if(from.nodeType !== to.nodeType || from.nodeName !== to.nodeName) {
+        from.replaceWith(document.importNode(to, true));
+    } else if(from.nodeType !== Node.ELEMENT_NODE) {
+        if(from.nodeValue !== to.nodeValue) from.nodeValue = to.nodeValue;
+    } else {
+        htag_morph_children(from, to);
+        htag_morph_attrs(from, to);
+    }
+}
+
+function htag_morph_attrs(from, to) {
+    var i;
+    for(i = from.attributes.length - 1; i >= 0; i--) {
+        if(!to.hasAttribute(from.attributes[i].name)) from.removeAttribute(from.attributes[i].name);
+    }
+    for(i = 0; i < to.attributes.length; i++) {
+        var a = to.attributes[i];
+        if(from.getAttribute(a.name) !== a.value) from.setAttribute(a.name, a.value);
+    }
+    // The state of form fields is held by properties: synced, unless the user is editing it
+    if(from === document.activeElement) return;
+    if(from.tagName === "INPUT") {
+        if(from.type === "checkbox" || from.type === "radio") from.checked = to.hasAttribute("checked");
+        else from.value = to.hasAttribute("value") ? to.getAttribute("value") : "";
+    } else if(from.tagName === "TEXTAREA") {
+        from.value = to.value;
+    } else if(from.tagName === "OPTION") {
+        from.selected = to.hasAttribute("selected");
+    }
+}
+
+function htag_morph_children(from, to) {
+    // The old children having an id can be reused wherever they are (moved rows keep their state)
+    var by_id = {};
+    for(var c = from.firstElementChild; c; c = c.nextElementSibling) if(c.id) by_id[c.id] = c;
+    var current = from.firstChild;
+    for(var node = to.firstChild; node; node = node.nextSibling) {
+        var match = null;
+        if(node.nodeType === Node.ELEMENT_NODE && node.id) {
+            match = by_id[node.id] || null;
+            delete by_id[node.id];
+        } else if(current && current.nodeType === node.nodeType && current.nodeName === node.nodeName
+                  && !(current.nodeType === Node.ELEMENT_NODE && current.id)) {
+            match = current;
+        }
+        if(!match) {
+            from.insertBefore(document.importNode(node, true), current);
+            continue;
+        }
+        if(match === current) current = current.nextSibling;
+        else from.insertBefore(match, current);
+        htag_morph_node(match, node);
+    }
+    while(current) {
+        var next = current.nextSibling;
+        from.removeChild(current);
+        current = next;
+    }
+}
+
+function htag_op(op) {
+    var el;
+    if(op[0] == "region") {         // ["region", owner_id, rid, html]: replace the content of a region
+        el = document.getElementById(op[1]);
+        var start = el && htag_marker(el, "htag:" + op[2]);
+        if(!start) return;
+        var end = start.nextSibling;
+        while(end && !(end.nodeType === Node.COMMENT_NODE && end.data === "/htag:" + op[2])) {
+            var next = end.nextSibling;
+            el.removeChild(end);
+            end = next;
+        }
+        el.insertBefore(htag_fragment(op[3]), end);
+    } else if(op[0] == "insert") {  // ["insert", parent_id, rid, before_id, html]
+        el = document.getElementById(op[1]);
+        if(el) el.insertBefore(htag_fragment(op[4]), htag_anchor(el, op[2], op[3]));
+    } else if(op[0] == "move") {    // ["move", id, parent_id, rid, before_id]
+        var node = document.getElementById(op[1]);
+        el = document.getElementById(op[2]);
+        if(node && el) el.insertBefore(node, htag_anchor(el, op[3], op[4]));
+    } else if(op[0] == "replace") { // ["replace", id, html]
+        el = document.getElementById(op[1]);
+        if(el) htag_replace(el, op[2]);
+    } else if(op[0] == "remove") {  // ["remove", id, parent_id]
+        el = document.getElementById(op[2]);
+        if(!el) return;
+        for(var child = el.firstElementChild; child; child = child.nextElementSibling) {
+            if(child.id === op[1]) { child.remove(); break; }
+        }
+    } else if(op[0] == "clear") {   // ["clear", id]
+        el = document.getElementById(op[1]);
+        if(el) el.innerHTML = "";
+    } else if(op[0] == "text") {    // ["text", id, text]
+        el = document.getElementById(op[1]);
+        if(el) el.textContent = op[2];
+    } else if(op[0] == "attrs") {   // ["attrs", id, {name: value (null: removed)}]
+        el = document.getElementById(op[1]);
+        if(!el) return;
+        for(var name in op[2]) {
+            var value = op[2][name];
+            if(value === null) el.removeAttribute(name); else el.setAttribute(name, value);
+            // The state of form fields is held by properties (the attributes are just the defaults)
+            if(name === "value") el.value = value === null ? "" : value;
+            else if(name === "checked" || name === "selected") el[name] = value !== null;
+        }
+    }
+}
+
 function fallback() {
     if (use_fallback) return; 
     use_fallback = true;
@@ -231,6 +409,12 @@ function fallback() {
     };
 }
 
+// A shell page (lazy sessions) comes without session cookie: the client picks its session id
+if(!document.cookie.split("; ").some(c => c.startsWith("htag_sid="))) {
+    var sid = Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, "0")).join("");
+    document.cookie = "htag_sid=" + sid + "; path=/; SameSite=Lax";
+}
+
 // Start with WebSockets
 init_ws();
 
@@ -295,6 +479,18 @@ class WebApp:
     """
     Starlette implementation for hosting one or more App sessions.
     Handles the HTTP initial render and the WebSocket communication.
+    The sessions without connected clients can be evicted: after `session_ttl` seconds
+    without activity (requests, events, connections), or the least recently used ones
+    when there are more than `max_sessions` (`on_evict(sid, instance)` is called then).
+    With `lazy_sessions`, the visitors without session get a shell page (rendered once, by
+    a prototype instance, and cacheable): their session is created when their client
+    connects (or posts an event).
+    With a `store`, the evicted sessions (and the ones whose clients are all disconnected)
+    are saved as snapshots of their States (see `App.snapshot`), and restored when their
+    visitor comes back (even on another server/worker sharing the store).
+    With `threaded_init`, the App instances are created in a worker thread, so a slow init
+    doesn't block the event loop: their init, on_instance and on_mount run in this thread
+    (not in the loop, which they must not use directly).
     """
 
     def __init__(
@@ -302,68 +498,346 @@ class WebApp:
         tag_entity: type[App] | App,
         on_instance: Callable[[App, Request | WebSocket], None] | None = None,
         debug: bool = True,
+        session_ttl: float | None = None,
+        max_sessions: int | None = None,
+        on_evict: Callable[[str, App], None] | None = None,
+        lazy_sessions: bool = False,
+        store: SessionStore | None = None,
+        threaded_init: bool = False,
     ) -> None:
-        self._lock = threading.Lock()
+        self._lock = threading.Lock()  # Guards the shared bookkeeping (not the App creations)
+        # sid -> [lock of its creation, number of its users, error of its failure]
+        self._creating: dict[str, list[Any]] = {}
+        self._creations: dict[str, asyncio.Future] = {}  # sid -> creation in a thread
+        self._saving: dict[str, asyncio.Future] = {}  # sid -> save of its snapshot in a thread
+        self._on_instance_sig: tuple[Callable[..., Any], int] | None = None
+        self.threaded_init = threaded_init
         self.tag_entity = tag_entity  # Class or Instance
         self.on_instance = on_instance  # Optional callback(instance)
         self.debug = debug
         self.instances: dict[str, App] = {}  # sid -> App instance
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.on_evict = on_evict  # Optional callback(sid, instance)
+        self._last_seen: OrderedDict[str, float] = OrderedDict()  # sid -> time, LRU first
+        self._sweeper: asyncio.Task | None = None
+        self.lazy_sessions = lazy_sessions
+        self._shell: str | None = None  # The shell page (lazy sessions)
+        self._shell_statics: set[str] = set()  # ... and the statics it holds
+        self.store = store
+        # (index, count) of this worker process, when run with workers (see `run`)
+        self.worker: tuple[int, int] | None = None
+        if os.environ.get("HTAG_WORKER") is not None:
+            self.worker = (int(os.environ["HTAG_WORKER"]), int(os.environ["HTAG_WORKERS"]))
         self.app = Starlette()
         self._setup_routes()
 
-    def _get_instance(self, sid: str, request_or_ws: Request | WebSocket) -> "App":
+    def _get_instance(
+        self, sid: str, request_or_ws: Request | WebSocket, data: bytes | None = None, load: bool = True
+    ) -> App:
+        """
+        The App instance of a session, created if needed (restored from its snapshot `data`,
+        or the one loaded from the store when `load`).
+        """
         if sid not in self.instances:
+            self._create_instance(sid, request_or_ws, data, load)
+
+        # Always update the current request object on the instance
+        # to ensure session data is fresh for the current interaction
+        instance = self.instances[sid]
+        setattr(instance, "_request", request_or_ws)
+
+        self.touch(sid)
+        if self.max_sessions is not None and len(self.instances) > self.max_sessions:
+            self.sweep(keep=sid)
+        expiring = self.session_ttl is not None or (self.store is not None and self.store.ttl is not None)
+        if expiring and self._sweeper is None:
+            try:
+                self._sweeper = asyncio.get_running_loop().create_task(self._sweep_forever())
+            except RuntimeError:
+                pass  # Not in a loop: swept on the next requests
+
+        return instance
+
+    async def _aget_instance(
+        self, sid: str, request_or_ws: Request | WebSocket, fresh: bool = False
+    ) -> App:
+        """
+        `_get_instance` for the endpoints: with `threaded_init`, a new session is created in
+        a thread, so the loop keeps serving the other sessions meanwhile (the concurrent
+        requests of this session wait for the same creation). The snapshot of a new session
+        is loaded from the store in a thread, once its save (see `save`) is done, and deleted
+        from it once restored; a `fresh` sid (just generated) has none.
+        """
+        data: bytes | None = None
+        if self.store is not None and sid not in self.instances and not fresh:
+            saving = self._saving.get(sid)
+            if saving is not None:
+                await asyncio.shield(saving)
+            data = await asyncio.to_thread(self._load, sid)
+        if self.threaded_init and sid not in self.instances:
+            creation = self._creations.get(sid)
+            if creation is None:
+                creation = asyncio.ensure_future(
+                    asyncio.to_thread(self._create_instance, sid, request_or_ws, data, False)
+                )
+                self._creations[sid] = creation
+                creation.add_done_callback(lambda _: self._creations.pop(sid, None))
+            await asyncio.shield(creation)
+        instance = self._get_instance(sid, request_or_ws, data, False)
+        if data is not None:
+            await asyncio.to_thread(self._delete, sid)
+        return instance
+
+    def _create_instance(
+        self, sid: str, request_or_ws: Request | WebSocket, data: bytes | None = None, load: bool = True
+    ) -> None:
+        """
+        Creates the App instance of a session (unless it exists), restored from its snapshot
+        `data` (or the one loaded from the store when `load`), under a lock of this
+        session only: a slow App init doesn't delay the creation of the other sessions.
+        The instance is available once fully initialized and mounted. When the creation
+        fails, the requests waiting for it fail with the same error.
+        """
+        with self._lock:
+            creating = self._creating.setdefault(sid, [threading.Lock(), 0, None])
+            creating[1] += 1
+        try:
+            with creating[0]:
+                if sid in self.instances:
+                    return  # Created meanwhile
+                if creating[2] is not None:
+                    raise creating[2]  # Failed meanwhile: its waiters fail the same way
+                token = current_request.set(request_or_ws)
+                try:
+                    if inspect.isclass(self.tag_entity):
+                        instance = self.tag_entity()
+                        logger.info("Created new session instance for sid: %s", sid)
+                    else:
+                        # tag_entity is an App instance
+                        instance = self.tag_entity  # type: ignore
+                        logger.info("Using shared instance for session sid: %s", sid)
+
+                    if self.on_instance:
+                        # Old signature (1 arg) or new (2 args)
+                        if self._on_instance_arity(self.on_instance) == 1:
+                            self.on_instance(instance)  # type: ignore
+                        else:
+                            self.on_instance(instance, request_or_ws)
+
+                    # Propagate debug mode
+                    instance.debug = self.debug
+                    # Created for a shell page (lazy sessions): its statics are loaded
+                    instance.sent_statics.update(self._shell_statics)
+
+                    if self.store is not None and inspect.isclass(self.tag_entity):
+                        if load:
+                            data = self._load(sid)
+                        if data is not None:
+                            self._restore(sid, instance, data)
+                            if load:
+                                self._delete(sid)  # (restored: it's in memory again)
+
+                    # Store a backlink to the webserver for session-aware logic
+                    setattr(instance, "_webserver", self)
+
+                    # Trigger lifecycle mount on the root App instance
+                    instance._trigger_mount()
+                    self.instances[sid] = instance
+                except BaseException as e:
+                    creating[2] = e
+                    raise
+                finally:
+                    current_request.reset(token)
+        finally:
+            with self._lock:  # Forgotten by the last one (a later request tries again)
+                creating[1] -= 1
+                if not creating[1]:
+                    del self._creating[sid]
+
+    def _on_instance_arity(self, on_instance: Callable[..., Any]) -> int:
+        """Number of parameters of `on_instance` (introspected once)."""
+        sig = self._on_instance_sig
+        if sig is None or sig[0] is not on_instance:
+            sig = self._on_instance_sig = (on_instance, len(inspect.signature(on_instance).parameters))
+        return sig[1]
+
+    def _get_shell(self, request: Request) -> str:
+        """The shell page of the lazy sessions, rendered once by a prototype instance."""
+        if self._shell is None:
             with self._lock:
-                if sid not in self.instances:
-                    token = current_request.set(request_or_ws)
+                if self._shell is None:
+                    token = current_request.set(request)
                     try:
-                        if inspect.isclass(self.tag_entity):
-                            self.instances[sid] = self.tag_entity()
-                            logger.info("Created new session instance for sid: %s", sid)
-                        else:
-                            # tag_entity is an App instance
-                            self.instances[sid] = self.tag_entity  # type: ignore
-                            logger.info("Using shared instance for session sid: %s", sid)
-
-                        if self.on_instance:
-                            # Check if it's the old signature (1 arg) or new (2 args)
-                            sig = inspect.signature(self.on_instance)
-                            if len(sig.parameters) == 1:
-                                self.on_instance(self.instances[sid])  # type: ignore
-                            else:
-                                self.on_instance(self.instances[sid], request_or_ws)
-
-                        # Propagate debug mode
-                        self.instances[sid].debug = self.debug
-
-                        # Store a backlink to the webserver for session-aware logic
-                        setattr(self.instances[sid], "_webserver", self)
-
-                        # Trigger lifecycle mount on the root App instance
-                        self.instances[sid]._trigger_mount()
+                        prototype: App = self.tag_entity()  # type: ignore
+                        prototype.debug = self.debug
+                        self._shell = "".join(prototype._iter_page(shell=True))
+                        self._shell_statics = set(prototype.sent_statics)
                     finally:
                         current_request.reset(token)
+        return self._shell
 
-        # Always update the current request object on the instance
-        # to ensure session data is fresh for the current interaction
-        setattr(self.instances[sid], "_request", request_or_ws)
+    def _new_sid(self) -> str:
+        """A new session id (for a worker: one of the sessions routed to it)."""
+        while True:
+            sid = str(uuid.uuid4())
+            if self.worker is None or worker_for(sid, self.worker[1]) == self.worker[0]:
+                return sid
 
-        return self.instances[sid]
+    def run(self, host: str = "127.0.0.1", port: int = 8000, workers: int = 1) -> None:
+        """
+        Serves this WebApp with uvicorn. With `workers` > 1, the script is re-run in as many
+        processes, each one serving its sessions (a session is bound to a worker by its
+        htag_sid cookie), behind a front dispatcher listening on host:port.
+        """
+        import uvicorn
+
+        if self.worker is not None:  # A worker process (re-run by run_workers)
+            uvicorn.run(self.app, host="127.0.0.1", port=int(os.environ["HTAG_WORKER_PORT"]))
+        elif workers > 1:
+            run_workers(host, port, workers)
+        else:
+            uvicorn.run(self.app, host=host, port=port)
+
+    def touch(self, sid: str) -> None:
+        """Records an activity of a session (it's the most recently used one)."""
+        self._last_seen[sid] = time.monotonic()
+        self._last_seen.move_to_end(sid)
+
+    def sweep(self, keep: str | None = None) -> list[str]:
+        """
+        Evicts the sessions idle for more than `session_ttl`, then the least recently used
+        ones over `max_sessions`. The sessions with connected clients (they are active: their
+        idle time starts at their last disconnection) and the session `keep` are kept.
+        Returns the evicted sids.
+        """
+        now = time.monotonic()
+        for sid, instance in list(self.instances.items()):
+            if instance.websockets or instance.sse_queues:
+                self.touch(sid)
+        evicted: list[str] = []
+        over = len(self.instances) - self.max_sessions if self.max_sessions is not None else 0
+        for sid, seen in list(self._last_seen.items()):  # LRU first
+            inst = self.instances.get(sid)
+            if inst is None:
+                self._last_seen.pop(sid, None)
+            elif sid == keep or inst.websockets or inst.sse_queues:
+                continue
+            elif over > 0 or (self.session_ttl is not None and now - seen > self.session_ttl):
+                self.evict(sid)
+                evicted.append(sid)
+                over -= 1
+        return evicted
+
+    def evict(self, sid: str) -> None:
+        """Frees a session: its App instance is unmounted (unless it's shared)."""
+        with self._lock:
+            inst = self.instances.pop(sid, None)
+            self._last_seen.pop(sid, None)
+        if inst is None:
+            return
+        logger.info("Evicted session sid: %s", sid)
+        if inst is not self.tag_entity:  # (a shared instance lives on for the other sessions)
+            self.save(sid, inst)  # (its state before the unmount)
+            inst._trigger_unmount()
+        if self.on_evict:
+            self.on_evict(sid, inst)
+
+    def save(self, sid: str, instance: App) -> asyncio.Future | None:
+        """
+        Saves a snapshot of a session in the store (if any). The snapshot is taken at once;
+        in a loop, the I/O of the store runs in a thread, not blocking the loop: returns its
+        future.
+        """
+        if self.store is None or instance is self.tag_entity:
+            return None
+        try:
+            data = instance.snapshot()
+        except Exception:
+            logger.exception("Failed to snapshot session sid %s", sid)
+            return None
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._save(sid, data)
+            return None
+        saving = asyncio.ensure_future(asyncio.to_thread(self._save, sid, data))
+        self._saving[sid] = saving
+
+        def done(_: asyncio.Future) -> None:
+            if self._saving.get(sid) is saving:
+                del self._saving[sid]
+
+        saving.add_done_callback(done)
+        return saving
+
+    def _save(self, sid: str, data: bytes) -> None:
+        try:
+            self.store.save(sid, data)  # type: ignore
+        except Exception:
+            logger.exception("Failed to save session sid %s", sid)
+
+    def _load(self, sid: str) -> bytes | None:
+        """The snapshot of a session in the store (if any)."""
+        try:
+            return self.store.load(sid)  # type: ignore
+        except Exception:
+            logger.exception("Failed to load session sid %s", sid)
+            return None
+
+    def _delete(self, sid: str) -> None:
+        try:
+            self.store.delete(sid)  # type: ignore
+        except Exception:
+            logger.exception("Failed to delete session sid %s", sid)
+
+    def _restore(self, sid: str, instance: App, data: bytes) -> None:
+        """Restores a new session instance from its snapshot."""
+        try:
+            instance.restore(data)
+            logger.info("Restored session sid: %s", sid)
+        except Exception:
+            logger.exception("Failed to restore session sid %s", sid)
+
+    async def _sweep_forever(self) -> None:
+        """The background sweeper of the idle sessions (and of the expired snapshots of the store)."""
+        while True:
+            await asyncio.sleep(min(60.0, (self.session_ttl or 60.0) / 2))
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Session sweep error")
+            if self.store is not None and self.store.ttl is not None:
+                try:
+                    await asyncio.to_thread(self.store.purge)
+                except Exception:
+                    logger.exception("Session store purge error")
 
     def _setup_routes(self) -> None:
-        async def index(request: Request) -> HTMLResponse:
+        async def index(request: Request) -> Response:
             htag_sid: str | None = request.cookies.get("htag_sid")
+            if htag_sid is None and self.lazy_sessions and inspect.isclass(self.tag_entity):
+                # No session yet: it will be created when the client of the shell connects
+                return HTMLResponse(
+                    self._get_shell(request), headers={"Cache-Control": "public, max-age=60"}
+                )
+            fresh = htag_sid is None
             if htag_sid is None:
-                htag_sid = str(uuid.uuid4())
+                htag_sid = self._new_sid()
 
-            instance = self._get_instance(htag_sid, request)
-            token = current_request.set(request)
-            try:
-                res = HTMLResponse(instance._render_page())
-                res.set_cookie("htag_sid", htag_sid)
-                return res
-            finally:
-                current_request.reset(token)
+            instance = await self._aget_instance(htag_sid, request, fresh)
+
+            async def page() -> AsyncIterator[str]:
+                # Render in a context holding the current request (the response is streamed later)
+                ctx = contextvars.copy_context()
+                ctx.run(current_request.set, request)
+                chunks = instance._iter_page()
+                while (chunk := ctx.run(next, chunks, None)) is not None:
+                    yield chunk
+
+            res = StreamingResponse(page(), media_type="text/html")
+            res.set_cookie("htag_sid", htag_sid)
+            return res
 
         async def favicon(request: Request) -> Response:
             import base64
@@ -372,12 +846,17 @@ class WebApp:
         async def websocket_endpoint(websocket: WebSocket) -> None:
             htag_sid: str | None = websocket.cookies.get("htag_sid")
             if htag_sid:
-                instance = self._get_instance(htag_sid, websocket)
+                instance = await self._aget_instance(htag_sid, websocket)
                 token = current_request.set(websocket)
                 try:
                     await instance._handle_websocket(websocket)
                 finally:
                     current_request.reset(token)
+                    self.touch(htag_sid)  # Idle from now
+                    if not (instance.websockets or instance.sse_queues):
+                        saving = self.save(htag_sid, instance)
+                        if saving is not None:
+                            await saving
             else:
                 await websocket.close()
 
@@ -386,7 +865,7 @@ class WebApp:
             if not htag_sid:
                 return Response(status_code=400, content="No session cookie")
 
-            instance = self._get_instance(htag_sid, request)
+            instance = await self._aget_instance(htag_sid, request)
             token = current_request.set(request)
             try:
                 return StreamingResponse(
@@ -400,7 +879,7 @@ class WebApp:
             if not htag_sid:
                 return Response(status_code=400, content="No session cookie")
 
-            instance = self._get_instance(htag_sid, request)
+            instance = await self._aget_instance(htag_sid, request)
             token = current_request.set(request)
             try:
                 msg = await request.json()
@@ -433,14 +912,42 @@ class App(GTag):
     """
 
     statics: list[GTag] = []
+    # Apply the re-rendered tags by morphing the DOM (only the differing nodes are touched)
+    # instead of replacing them with outerHTML
+    morph: bool = False
+    # Max number of update payloads sent per second: the broadcasts coming faster (e.g. the
+    # yields of a generator callback) are merged into the next frame. None: no limit
+    max_fps: float | None = None
+    # Delay (in seconds) after which the changes made outside of the events (by background
+    # tasks or threads) are pushed to the clients, all together. None: not pushed
+    auto_flush: float | None = 0.05
+    # Max number of payloads waiting to be sent to a (slow) client, and what to do when it's
+    # reached: "coalesce" them into the full state of the page, or "disconnect" the client
+    max_queue: int = 100
+    overflow: str = "coalesce"
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
+        if self.overflow not in ("coalesce", "disconnect"):
+            raise ValueError(f"Unknown overflow policy: {self.overflow!r}")
         super().__init__("body", *args, **kwargs)
         self.exit_on_disconnect: bool = False  # Default behavior for Web/API apps
         self.debug: bool = True  # Local debug mode default
         self.websockets: set[WebSocket] = set()
         self.sse_queues: set[asyncio.Queue] = set()  # Queues for active SSE connections
+        # Queue of outgoing payloads and writer task, of each websocket
+        self.ws_writers: dict[WebSocket, tuple[asyncio.Queue, asyncio.Task]] = {}
         self.sent_statics: set[str] = set()  # Track assets already in browser
+        # Last sent render of the tags (to send the differences of their next renders)
+        self.sent_snapshots: weakref.WeakKeyDictionary[GTag, Snapshot] = weakref.WeakKeyDictionary()
+        # Frame scheduling of the broadcasts (see max_fps)
+        self.last_flush: float = 0.0
+        self.next_frame: asyncio.TimerHandle | None = None
+        # Automatic push of the changes made outside of the events (see auto_flush)
+        self.event_loop: asyncio.AbstractEventLoop | None = None  # The loop of the clients
+        self.flush_requested: bool = False
+        index = self._get_index()
+        if index is not None:
+            index.on_pending = self._request_flush
 
     @property
     def app(self) -> Starlette:
@@ -449,7 +956,26 @@ class App(GTag):
             self._app_host = WebApp(self)
         return self._app_host.app
 
-    def _render_page(self) -> str:
+    def _iter_page(self, shell: bool = False) -> Iterator[str]:
+        """
+        Yields the full HTML page in two chunks: the head (with the client bridge) first,
+        so the browser can start parsing it while the body (and the statics it needs) renders.
+        A `shell` page has its body replaced by the one of the session its client connects to.
+        """
+        yield f"""
+        <!DOCTYPE html>
+        <html>
+            <head>
+                <title>{self.__class__.__name__}</title>
+                <link rel="icon" href="/logo.png">
+                <script>{CLIENT_JS}</script>
+                <script>
+                    window.HTAG_RELOAD = {"true" if getattr(self, "_reload", False) else "false"};
+                    window.HTAG_MORPH = {"true" if self.morph else "false"};
+                    window.HTAG_SHELL = {"true" if shell else "false"};
+                </script>
+"""
+
         # 1. Render the initial body FIRST to populate __rendered_callables
         try:
             body_html = self.render_initial()
@@ -470,46 +996,77 @@ class App(GTag):
         except Exception:
             pass  # Fatal error already caught above
         self.sent_statics.update(all_statics)
+        index = self._get_index()
+        if index is not None:
+            index.reset_statics(all_statics)
         statics_html = "".join(all_statics)
 
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-            <head>
-                <title>{self.__class__.__name__}</title>
-                <link rel="icon" href="/logo.png">
-                <script>{CLIENT_JS}</script>
-                <script>
-                    window.HTAG_RELOAD = {"true" if getattr(self, "_reload", False) else "false"};
-                </script>
-                {statics_html}
+        yield f"""                {statics_html}
             </head>
             {body_html}
         </html>
         """
-        return html_content
+
+    def _render_page(self) -> str:
+        return "".join(self._iter_page())
+
+    def _iter_states(self) -> Iterator[tuple[str, State]]:
+        """
+        Yields the States held by the attributes of the tags of the (static) tree, keyed by
+        their path in it (stable between the instances built the same way).
+        """
+        stack: list[tuple[str, GTag]] = [("", self)]
+        while stack:
+            path, tag = stack.pop()
+            for name, value in vars(tag).items():
+                if isinstance(value, State) and not isinstance(value, Computed):
+                    yield f"{path}:{name}", value
+            children = [c for c in tag.childs if isinstance(c, GTag)]
+            stack.extend((f"{path}/{i}", c) for i, c in enumerate(children))
+
+    def snapshot(self) -> bytes:
+        """
+        The state of this App as compact bytes (to be restored in a new instance built the
+        same way, see `restore`): the values of the States held by the attributes of its
+        tags (the tree itself is rebuilt by the instance's `init`). The values must be
+        picklable.
+        """
+        values = {key: state.value for key, state in self._iter_states()}
+        return zlib.compress(pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def restore(self, data: bytes) -> None:
+        """Restores the values of the States, from a `snapshot` (of another instance)."""
+        values: dict[str, Any] = pickle.loads(zlib.decompress(data))
+        with State.batch():
+            for key, state in self._iter_states():
+                if key in values:
+                    state.value = values[key]
 
     async def _handle_sse(self, request: Request):
-        queue: asyncio.Queue = asyncio.Queue()
-        self.sse_queues.add(queue)
-        logger.info("New SSE connection (Total clients: %d)", len(self.sse_queues))
+        self.event_loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue)
 
-        # Send initial state
+        # Send initial state (registered after it: the other clients may get it too)
         try:
             updates = {self.id: self.render_initial()}
             js: list[str] = []
             self.collect_updates(self, {}, js)
-
-            payload = json.dumps({"action": "update", "updates": updates, "js": js})
-            # EventSource requires 'data: {payload}\n\n'
-            yield f"data: {payload}\n\n"
+            payload = json.dumps({"action": "update", "updates": updates, "js": js, "init": True})
         except Exception as e:
             logger.error("Failed to send initial SSE state: %s", e)
+            payload = None
+        self.sse_queues.add(queue)
+        logger.info("New SSE connection (Total clients: %d)", len(self.sse_queues))
+        if payload is not None:
+            # EventSource requires 'data: {payload}\n\n'
+            yield f"data: {payload}\n\n"
 
         try:
             while True:
                 # Wait for next broadcast payload or client disconnect
                 message = await queue.get()
+                if message is None:  # Disconnected (too slow)
+                    break
                 yield f"data: {message}\n\n"
         except asyncio.CancelledError:  # Raised when client disconnects
             pass
@@ -522,21 +1079,26 @@ class App(GTag):
 
     async def _handle_websocket(self, websocket: WebSocket) -> None:
         await websocket.accept()
-        self.websockets.add(websocket)
-        logger.info(
-            "New WebSocket connection (Total WS clients: %d)", len(self.websockets)
-        )
+        self.event_loop = asyncio.get_running_loop()
 
-        # Send initial state on connection/reconnection
+        # Send initial state on connection/reconnection (registered after it: the other
+        # clients may get it too)
         try:
             updates = {self.id: self.render_initial()}
             js: list[str] = []
             self.collect_updates(self, {}, js)  # We only want the JS calls here
-
-            await websocket.send_text(
-                json.dumps({"action": "update", "updates": updates, "js": js})
-            )
-            logger.debug("Sent initial state to client")
+            payload = json.dumps({"action": "update", "updates": updates, "js": js, "init": True})
+        except Exception as e:
+            logger.error("Failed to render initial state: %s", e)
+            payload = None
+        self.websockets.add(websocket)
+        logger.info(
+            "New WebSocket connection (Total WS clients: %d)", len(self.websockets)
+        )
+        try:
+            if payload is not None:
+                await websocket.send_text(payload)
+                logger.debug("Sent initial state to client")
         except Exception as e:
             logger.error("Failed to send initial state: %s", e)
 
@@ -548,8 +1110,7 @@ class App(GTag):
         except (WebSocketDisconnect, Exception):
             pass
         finally:
-            if websocket in self.websockets:
-                self.websockets.discard(websocket)
+            self._drop_websocket(websocket)
             logger.info(
                 "WebSocket disconnected (Total WS clients: %d)", len(self.websockets)
             )
@@ -593,36 +1154,161 @@ class App(GTag):
         else:
             logger.info("Last client disconnected (server stays alive)")
 
+    def _request_flush(self) -> None:
+        """
+        Called (from any thread) when a tag gets pending changes: schedules a broadcast on the
+        loop of the clients, `auto_flush` seconds later (so the changes made meanwhile are
+        sent together). The changes made by an event are usually sent by the event itself,
+        and this broadcast is skipped (nothing left to send).
+        """
+        loop = self.event_loop
+        if self.auto_flush is None or loop is None or self.flush_requested:
+            return
+        self.flush_requested = True
+        try:
+            loop.call_soon_threadsafe(self._start_auto_flush)
+        except RuntimeError:  # The loop is closed
+            self.flush_requested = False
+
+    def _start_auto_flush(self) -> None:
+        asyncio.ensure_future(self._auto_flush())
+
+    async def _auto_flush(self) -> None:
+        await asyncio.sleep(self.auto_flush or 0)
+        self.flush_requested = False
+        index = self._get_index()
+        if index is not None and not index.pending and not index.new_statics:
+            return  # Already sent (by an event)
+        if self.websockets or self.sse_queues:
+            await self.broadcast_updates()
+
     def render_initial(self) -> str:
-        # Initial render of the page (body)
-        return self.render_tag(self)
+        """
+        Initial render of the page (body), for a new client. It becomes the last sent render
+        of the tags: the clients already connected (other tabs of the session) get it too,
+        when it holds changes they haven't received yet.
+        """
+        index = self._get_index()
+        stale = index is None or any(t.is_dirty for t in list(index.pending))
+        html = self.render_tag(self)
+        if stale and (self.websockets or self.sse_queues):
+            self._send_all(json.dumps({"action": "update", "updates": {self.id: html}}))
+        return html
 
     def _walk_tree(self, tag: GTag, visitor: Callable[[GTag], None]) -> None:
-        """Generic tree walker: visits static children and rendered callables."""
-        visitor(tag)
-        for child in tag.childs:
-            if isinstance(child, GTag):
-                self._walk_tree(child, visitor)
-        for tag_list in tag._get_rendered_callables().values():
-            for t in tag_list:
-                self._walk_tree(t, visitor)
+        """Generic (non-recursive) tree walker: visits static children and rendered callables."""
+        for t in tag._iter_tree():
+            visitor(t)
+
+    def _take_pending(self, tag: GTag) -> list[GTag]:
+        """
+        Pop the registered pending tags (dirty or with JS calls) living under `tag`,
+        sorted top-down (a parent render also refreshes its static children).
+        """
+        index = self._get_index()
+        if index is None:
+            return []
+        found: list[tuple[int, GTag]] = []
+        for t in list(index.pending):
+            depth = 0
+            current: GTag | None = t
+            while current is not None and current is not tag:
+                current = current.parent
+                depth += 1
+            if current is not None:
+                found.append((depth, t))
+            elif tag is not self and t.root is self:
+                continue  # Pending elsewhere in the tree, keep it for later
+            index.pending.pop(t, None)
+        found.sort(key=lambda x: x[0])
+        return [t for _, t in found]
 
     def collect_updates(
-        self, tag: GTag, updates: dict[str, str], js_calls: list[str]
+        self,
+        tag: GTag,
+        updates: dict[str, str],
+        js_calls: list[str],
+        ops: list[list[Any]] | None = None,
     ) -> None:
         """
-        Recursively traverses the tag tree to find 'dirty' tags that need re-rendering.
-        Also collects pending JavaScript calls from tags.
+        Finds the 'dirty' tags that need re-rendering, and collects pending JavaScript calls.
+        Only the tags registered as pending (by dirty marking or call_js) are visited.
+        If `ops` is given, a tag with only attribute changes (`["attrs", tag_id, {name: value}]`
+        ops), structural changes (see `render_child_ops`) or changes of the States read by
+        its reactive children is not rendered as a whole: its stale regions are re-rendered
+        (`["region", tag_id, rid, html]` ops), or just their changed rows (see `render_patch`).
         """
-        def visitor(t: GTag) -> None:
-            with t._GTag__lock:
-                if t.is_dirty:
-                    updates[t.id] = self.render_tag(t)
-                pending_js = t._consume_js_calls()
-                if pending_js:
-                    js_calls.extend(pending_js)
+        visited: set[GTag] = set()
+        rendered: set[GTag] = set()
+        while True:
+            # Rendering may mount new tags (reactive lambdas) with their own updates/JS calls
+            pending = [t for t in self._take_pending(tag) if t not in visited]
+            if not pending:
+                break
+            for t, stale in self._plan_updates(pending, rendered, ops is not None):
+                with t._GTag__lock:
+                    if stale is None:
+                        snapshots: dict[GTag, Snapshot] = {}
+                        html = self.render_tag(t, snapshots)
+                        patch: list[list[Any]] = []
+                        if ops is not None and self._diff(t, snapshots, patch):
+                            ops.extend(patch)
+                        else:
+                            updates[t.id] = html
+                        self.sent_snapshots.update(snapshots)
+                        rendered.add(t)
+                    else:
+                        self.sent_snapshots.pop(t, None)  # Patched: its content is no more known
+                        attrs = t._changed_attrs()
+                        if attrs:
+                            ops.append(["attrs", t.id, attrs])  # type: ignore
+                        ops.extend(self.render_child_ops(t))  # type: ignore
+                        for child in stale:
+                            rows = self.render_patch(t, child)
+                            if rows is None:
+                                html = self.render_region(t, child)
+                                rows = [["region", t.id, t._region_id(child), html]]
+                            ops.extend(rows)  # type: ignore
+                        t._reset_dirty()
+            for t in pending:
+                visited.add(t)
+                with t._GTag__lock:
+                    pending_js = t._consume_js_calls()
+                    if pending_js:
+                        js_calls.extend(pending_js)
 
-        self._walk_tree(tag, visitor)
+    def _plan_updates(
+        self, pending: list[GTag], rendered: set[GTag], regions: bool = False
+    ) -> list[tuple[GTag, list[Callable] | None]]:
+        """
+        Computes the minimal set of topmost dirty tags to render, as (tag, stale regions)
+        (stale regions is None when the whole tag is rendered, see `GTag._stale_regions`).
+        A dirty tag having a fully rendered (or already rendered) ancestor is part of that
+        ancestor's HTML: its flag is cleared, without re-serializing it.
+        """
+        plan: dict[GTag, list[Callable] | None] = {}
+        appended: set[GTag] = set()  # Rendered as a whole, by the "insert" op of their parent
+        for t in pending:
+            if t.is_dirty:
+                plan[t] = t._stale_regions() if regions else None
+                if plan[t] is not None:
+                    appended.update(op[1] for op in t._get_child_ops() if op[0] == "append" and isinstance(op[1], GTag))
+        roots: list[tuple[GTag, list[Callable] | None]] = []
+        for t in pending:  # top-down
+            if t not in plan:
+                continue
+            current: GTag | None = t
+            while current is not None and current not in appended:
+                current = current.parent
+                if current is not None and (plan.get(current, False) is None or current in rendered):
+                    break
+            if current is None:
+                roots.append((t, plan[t]))
+            else:
+                del plan[t]  # Covered: no more a full render candidate for its descendants
+                with t._GTag__lock:
+                    t._reset_dirty()
+        return roots
 
     def collect_statics(self, tag: GTag, result: list[str]) -> None:
         """Recursively collects statics from the whole tag tree."""
@@ -710,14 +1396,14 @@ class App(GTag):
                     )
 
                     if ws:
-                        try:
-                            await ws.send_text(err_payload)
-                        except Exception:
-                            pass
+                        # Through its writer, after the payloads already queued for it
+                        if ws in self.websockets:  # (not dropped meanwhile)
+                            self._send_ws(ws, err_payload)
+                            await asyncio.sleep(0)  # Let the writer send it
                     else:
                         # Fallback Mode: Trigger error broadcast through SSE
-                        for queue in self.sse_queues:
-                            queue.put_nowait(err_payload)
+                        for queue in list(self.sse_queues):
+                            self._send_sse(queue, err_payload)
 
                     return
             else:
@@ -731,12 +1417,27 @@ class App(GTag):
         Collects all pending updates (tags, JS calls, statics)
         and broadcasts them to all connected clients.
         Optional 'result' and 'callback_id' are used to resolve client-side Promises.
+        With a `max_fps`, a broadcast coming less than a frame after the previous one is
+        deferred to the next frame, merged with the following ones (a broadcast resolving
+        a Promise is always sent at once, with all the pending changes).
         """
+        loop = asyncio.get_running_loop()
+        if self.max_fps and not callback_id:
+            delay = self.last_flush + 1 / self.max_fps - loop.time()
+            if delay > 0:
+                if self.next_frame is None:
+                    self.next_frame = loop.call_later(delay, self._flush_frame)
+                return
+        if self.next_frame is not None:
+            self.next_frame.cancel()  # Its changes are sent now
+            self.next_frame = None
+
         updates: dict[str, str] = {}
         js_calls: list[str] = []
+        ops: list[list[Any]] = []
 
         try:
-            self.collect_updates(self, updates, js_calls)
+            self.collect_updates(self, updates, js_calls, ops)
         except Exception as e:
             error_trace = traceback.format_exc()
             error_msg = (
@@ -753,32 +1454,27 @@ class App(GTag):
                 }
             )
 
-            # Send to websocket clients
-            dead_ws: list[WebSocket] = []
-            for client in list(self.websockets):
-                try:
-                    await client.send_text(err_payload)
-                except Exception:
-                    dead_ws.append(client)
-            for client in dead_ws:
-                self.websockets.discard(client)
-
-            # Send to SSE clients
-            for queue in self.sse_queues:
-                queue.put_nowait(err_payload)
-
+            self._send_all(err_payload)
+            await asyncio.sleep(0)  # Let the writers send it
             return  # Abort sending normal updates
 
-        all_statics: list[str] = []
-        self.collect_statics(self, all_statics)
+        # Statics can only come with new tags (or a reassigned `statics`): the index records them
+        index = self._get_index()
+        if index is None:
+            all_statics: list[str] = []
+            self.collect_statics(self, all_statics)
+        else:
+            all_statics = index.take_statics()
         new_statics = [s for s in all_statics if s not in self.sent_statics]
 
-        if updates or js_calls or new_statics or callback_id:
+        if updates or ops or js_calls or new_statics or callback_id:
+            self.last_flush = loop.time()  # (an empty broadcast doesn't delay the next frame)
             self.sent_statics.update(new_statics)
 
             data = {
                 "action": "update",
                 "updates": updates,
+                "ops": ops,
                 "js": js_calls,
                 "statics": new_statics,
             }
@@ -787,64 +1483,328 @@ class App(GTag):
                 data["result"] = result
 
             logger.debug(
-                "Broadcasting updates: %s (js calls: %d, result: %s)",
+                "Broadcasting updates: %s (ops: %d, js calls: %d, result: %s)",
                 list(updates.keys()),
+                len(ops),
                 len(js_calls),
                 result if callback_id else "n/a",
             )
 
             payload = json.dumps(data)
 
-            # Send to websocket clients
-            dead_ws_clients: list[WebSocket] = []
-            for client in list(self.websockets):
-                try:
-                    await client.send_text(payload)
-                except Exception:
-                    dead_ws_clients.append(client)
-            for client in dead_ws_clients:
-                self.websockets.discard(client)
+            # The full state of the page, for the clients too slow to get all the payloads
+            full: list[str] = []
+            def resync() -> str:
+                if not full:
+                    full.append(self.render_tag(self))
+                return full[0]
+
+            self._send_all(payload, resync)
+            await asyncio.sleep(0)  # Let the writers send it
+
+    def _send_all(self, payload: str, resync: Callable[[], str] | None = None) -> None:
+        """
+        Queues a payload for all the clients. Each websocket has its own writer task, so a
+        slow client can't delay the others (the SSE clients pull their queue themselves).
+        """
+        for ws in list(self.ws_writers):
+            if ws not in self.websockets:
+                self._drop_websocket(ws)  # Removed without its handler (e.g. by a test)
+        for ws in list(self.websockets):
+            self._send_ws(ws, payload, resync)
+        for queue in list(self.sse_queues):
+            self._send_sse(queue, payload, resync)
+
+    def _send_ws(self, ws: WebSocket, payload: str, resync: Callable[[], str] | None = None) -> None:
+        """Queues a payload for a websocket, disconnecting it when it's too slow (see `_enqueue`)."""
+        if not self._enqueue(self._ws_queue(ws), payload, resync):
+            logger.warning("WebSocket client too slow, disconnecting it")
+            self._drop_websocket(ws)
+            asyncio.ensure_future(self._close_websocket(ws))
+
+    def _send_sse(self, queue: asyncio.Queue, payload: str, resync: Callable[[], str] | None = None) -> None:
+        """Queues a payload for a SSE client, ending its stream when it's too slow (see `_enqueue`)."""
+        if not self._enqueue(queue, payload, resync):
+            logger.warning("SSE client too slow, disconnecting it")
+            self.sse_queues.discard(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)  # Ends its stream
+
+    def _ws_queue(self, ws: WebSocket) -> asyncio.Queue:
+        """The queue of the payloads to send to a websocket (its writer task starts with it)."""
+        if ws not in self.ws_writers:
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue)
+            self.ws_writers[ws] = (queue, asyncio.create_task(self._write_websocket(ws, queue)))
+        return self.ws_writers[ws][0]
+
+    def _enqueue(
+        self, queue: asyncio.Queue, payload: str, resync: Callable[[], str] | None = None
+    ) -> bool:
+        """
+        Queues a payload for a client. When the client is too slow and its queue is full, the
+        `overflow` policy applies: "coalesce" replaces the waiting payloads by a single one,
+        holding the full state of the page (`resync()`) plus their JS calls, statics and
+        Promise results; "disconnect" returns False (the client must be dropped).
+        Without `resync` (error reports), the payload is just dropped.
+        """
+        if not queue.full():
+            queue.put_nowait(payload)
+            return True
+        if self.overflow == "disconnect":
+            return False
+        if resync is None:
+            logger.warning("Client too slow, payload dropped")
+            return True
+        merged: dict[str, Any] = {
+            "action": "update", "updates": {}, "ops": [], "js": [], "statics": [], "callbacks": {},
+        }
+        waiting = [queue.get_nowait() for _ in range(queue.qsize())] + [payload]
+        for data in map(json.loads, waiting):
+            if data.get("action") == "update":
+                merged["js"].extend(data.get("js", []))
+                merged["statics"].extend(data.get("statics", []))
+            if data.get("callback_id"):
+                merged["callbacks"][data["callback_id"]] = data.get("result")
+        merged["updates"][self.id] = resync()
+        queue.put_nowait(json.dumps(merged))
+        return True
+
+    async def _write_websocket(self, ws: WebSocket, queue: asyncio.Queue) -> None:
+        """The writer task of a websocket: sends its queued payloads, in order."""
+        try:
+            while True:
+                payload = await queue.get()
+                await ws.send_text(payload)
+        except Exception:
+            logger.info("WebSocket send failed, client removed")
+            self.websockets.discard(ws)
+            self.ws_writers.pop(ws, None)
+
+    def _drop_websocket(self, ws: WebSocket) -> None:
+        """Forgets a websocket, and stops its writer task."""
+        self.websockets.discard(ws)
+        writer = self.ws_writers.pop(ws, None)
+        if writer is not None:
+            writer[1].cancel()
+
+    async def _close_websocket(self, ws: WebSocket) -> None:
+        try:
+            await ws.close()
+        except Exception:
+            pass
 
-            # Send to SSE clients
-            for queue in self.sse_queues:
-                queue.put_nowait(payload)
+    def _flush_frame(self) -> None:
+        """Sends the broadcasts deferred to this frame (see max_fps)."""
+        self.next_frame = None
+        asyncio.ensure_future(self.broadcast_updates())
 
-    def render_tag(self, tag: GTag) -> str:
+    def render_tag(self, tag: GTag, snapshots: MutableMapping[GTag, Snapshot] | None = None) -> str:
         """
         Renders a GTag to its HTML string representation.
-        Before rendering, it injects 'htag_event' calls into HTML event attributes,
-        enabling the bridge between DOM events and Python callbacks.
+        The dirty flags of the whole rendered subtree are cleared, as it's fully serialized.
+        The snapshots of the rendered tags are put in `snapshots` (if given), else kept
+        as the last sent ones (see `_diff`).
+        (htag_event calls are injected into HTML event attributes at render time,
+        enabling the bridge between DOM events and Python callbacks)
+        """
+        for t in tag._iter_tree():
+            with t._GTag__lock:
+                t._reset_dirty()  # Clear dirty flag after rendering
+        out: list[str] = []
+        tag._render(out, snapshots=self.sent_snapshots if snapshots is None else snapshots)
+        return out[0] if len(out) == 1 else "".join(out)
+
+    def _diff(self, tag: GTag, snapshots: MutableMapping[GTag, Snapshot], ops: list[list[Any]]) -> bool:
+        """
+        Appends to `ops` the DOM operations turning the last sent render of `tag` into its
+        new one (described by `snapshots`): attribute patches, removals/insertions of the
+        changed range of its content (or the rendering of the reactive region holding it),
+        and the same for its re-rendered children (`["replace", id, html]` when a child
+        must be replaced as a whole). Iterative (explicit stack), like the renderer.
+        Returns False when `tag` must be replaced as a whole.
+        """
+        todo: list[tuple[GTag, str]] = [(tag, "")]
+        while todo:
+            t, html = todo.pop()
+            diff = self._diff_tag(t, snapshots)
+            if diff is None:
+                if t is tag:
+                    return False
+                ops.append(["replace", t.id, html])
+                continue
+            tag_ops, kept = diff
+            ops.extend(tag_ops)
+            todo.extend(reversed(kept))
+        return True
+
+    def _diff_tag(
+        self, tag: GTag, snapshots: MutableMapping[GTag, Snapshot]
+    ) -> tuple[list[list[Any]], list[tuple[GTag, str]]] | None:
+        """
+        The DOM operations of `tag` itself (see `_diff`), and its children kept in place
+        (which may have been re-rendered too) as (child, html).
+        Returns None when `tag` must be replaced as a whole.
+        """
+        new = snapshots.get(tag)
+        if new is None:
+            return [], []  # Not re-rendered (its cache was valid): unchanged
+        old = self.sent_snapshots.get(tag)
+        if old is None or old[0] != new[0] or not new[0] or new[0] in WHOLE_CONTENT_ELEMENTS:
+            return None
+        _, old_attrs, old_content = old
+        _, new_attrs, new_content = new
+        if any(child is not None and not child.tag for child, _ in new_content):
+            return None  # Content without element: not addressable
+
+        ops: list[list[Any]] = []
+        changes: dict[str, str | None] = {k: v for k, v in new_attrs.items() if old_attrs.get(k) != v}
+        changes.update({k: None for k in old_attrs if k not in new_attrs})
+        if changes:
+            ops.append(["attrs", tag.id, changes])
+
+        def same(a: tuple[GTag | None, str], b: tuple[GTag | None, str]) -> bool:
+            return a[0] is b[0] if a[0] is not None else b[0] is None and a[1] == b[1]
+
+        # The changed range of the content, between the common prefix and suffix
+        size = min(len(old_content), len(new_content))
+        start = 0
+        while start < size and same(old_content[start], new_content[start]):
+            start += 1
+        end = 0
+        while end < size - start and same(old_content[-1 - end], new_content[-1 - end]):
+            end += 1
+        removed = old_content[start : len(old_content) - end]
+        inserted = new_content[start : len(new_content) - end]
+        if removed or inserted:
+            after = new_content[len(new_content) - end] if end else None
+            if all(child is not None for child, _ in removed) and (after is None or after[0] is not None):
+                for child, _ in removed:
+                    ops.append(["remove", child.id, tag.id])  # type: ignore
+                if inserted:
+                    before = after[0].id if after is not None else None  # type: ignore
+                    ops.append(["insert", tag.id, None, before, "".join(html for _, html in inserted)])
+            else:
+                # Text nodes can't be addressed: render the region holding them, if any
+                region = self._enclosing_region(new_content, start, len(new_content) - end)
+                if region is None:
+                    return None
+                rid, first, last = region
+                ops.append(["region", tag.id, rid, "".join(html for _, html in new_content[first + 1 : last])])
+                start, end = first, len(new_content) - last
+
+        kept = new_content[:start] + new_content[len(new_content) - end :]
+        return ops, [(child, html) for child, html in kept if child is not None]
+
+    @staticmethod
+    def _enclosing_region(
+        content: list[tuple[GTag | None, str]], start: int, stop: int
+    ) -> tuple[str, int, int] | None:
+        """
+        Finds the innermost reactive region holding `content[start:stop]`,
+        as (rid, index of its start marker, index of its end marker).
         """
+        skipped: list[str] = []  # regions closed before `start`
+        for i in range(start - 1, -1, -1):
+            child, html = content[i]
+            if child is not None:
+                continue
+            if html.startswith("<!--/htag:"):
+                skipped.append(html[10:-3])
+            elif html.startswith("<!--htag:"):
+                rid = html[9:-3]
+                if skipped and skipped[-1] == rid:
+                    skipped.pop()
+                    continue
+                closing = f"<!--/htag:{rid}-->"
+                for j in range(stop, len(content)):
+                    if content[j][0] is None and content[j][1] == closing:
+                        return rid, i, j
+                return None
+        return None
 
-        def process(t: GTag) -> None:
-            if isinstance(t, GTag):
+    def render_region(self, tag: GTag, child: Callable) -> str:
+        """
+        Renders the content of the region of a reactive child of `tag`.
+        The dirty flags of the tags it produced are cleared, as they're fully serialized.
+        """
+        html = tag._render_region(child, self.sent_snapshots)
+        for produced in tag._get_rendered_callables().get(child, []):
+            for t in produced._iter_tree():
                 with t._GTag__lock:
-                    # Auto-inject oninput for inputs if not already there, to support auto-binding
-                    if (
-                        t.tag in ["input", "textarea", "select"]
-                        and "input" not in t._get_events()
-                    ):
-                        t._get_attrs()["oninput"] = (
-                            f"htag_event('{t.id}', 'input', event)"
-                        )
-                    t._reset_dirty()  # Clear dirty flag after rendering
-                    for child in t.childs:
-                        if isinstance(child, GTag):
-                            process(child)
-
-        process(tag)
-        return str(tag)
+                    t._reset_dirty()
+        return html
 
-    def find_tag(self, root: GTag, tag_id: str) -> GTag | None:
-        """Recursively find a tag by its ID, searching both static and dynamic (reactive) children."""
-        result: list[GTag | None] = [None]
+    def render_child_ops(self, tag: GTag) -> list[list[Any]]:
+        """
+        Renders the structural changes logged by `tag` (see `GTag._log_child_op`), as DOM
+        operations: `["insert", tag_id, None, None, html]` (at the end),
+        `["remove", child_id, tag_id]` and `["clear", tag_id]`;
+        or `["text", tag_id, text]` when its content is replaced by plain text.
+        """
+        child_ops = tag._get_child_ops()
+        if child_ops and child_ops[0][0] == "clear":
+            texts = [op[1] for op in child_ops[1:] if not isinstance(op[1], GTag) and not callable(op[1])]
+            if len(texts) == len(child_ops) - 1:
+                text = "".join(str(i) for i in texts)
+                if "<" not in text and "&" not in text:  # (strings are rendered as HTML)
+                    return [["text", tag.id, text]]
+        ops: list[list[Any]] = []
+        for op in child_ops:
+            if op[0] == "append":
+                item = op[1]
+                html = self.render_tag(item) if isinstance(item, GTag) else str(item)
+                ops.append(["insert", tag.id, None, None, html])
+            elif op[0] == "remove":
+                ops.append(["remove", op[1].id, tag.id])
+            else:
+                ops.append(["clear", tag.id])
+        return ops
 
-        def visitor(t: GTag) -> None:
-            if result[0] is None and t.id == tag_id:
-                result[0] = t
+    def render_patch(self, tag: GTag, child: Callable) -> list[list[Any]] | None:
+        """
+        Renders the changes of the rows of a reactive child of `tag` which describes them
+        (like `For` over a `StateList`), as DOM operations:
+        `["insert", tag_id, rid, before_id, html]`, `["move", row_id, tag_id, rid, before_id]`
+        and `["remove", row_id, tag_id]`.
+        Returns None when its whole region must be rendered.
+        """
+        if not isinstance(child, For):
+            return None
+        tag._eval_callable(child)
+        changes = child.changes
+        if changes is None:
+            return None
+        # The rows (and the rows they're placed before) must be elements
+        if not all(isinstance(row, GTag) for change in changes for row in change[1:] if row is not None):
+            return None
+        rid = tag._region_id(child)
+        ops: list[list[Any]] = []
+        for kind, row, *next_row in changes:
+            before = next_row[0].id if next_row and next_row[0] is not None else None
+            if kind == "insert":
+                ops.append(["insert", tag.id, rid, before, self.render_tag(row)])
+            elif kind == "move":
+                ops.append(["move", row.id, tag.id, rid, before])
+            else:
+                ops.append(["remove", row.id, tag.id])
+        return ops
 
-        self._walk_tree(root, visitor)
-        return result[0]
+    def find_tag(self, root: GTag, tag_id: str) -> GTag | None:
+        """
+        Find a tag by its ID, in constant time, using the App's id index
+        (which covers both static and dynamic (reactive) children).
+        """
+        index = self._get_index()
+        tag = index.tags.get(tag_id) if index is not None else None
+        if tag is not None and root is not self:
+            # Ensure the tag lives under the requested subtree
+            current: GTag | None = tag
+            while current is not None and current is not root:
+                current = current.parent
+            if current is None:
+                return None
+        return tag
 
 
 from .core import Tag  # noqa: E402
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any
+
+
+class SessionStore(ABC):
+    """
+    Where the sessions evicted from memory are kept, as App snapshots (see `App.snapshot`),
+    to be restored when their visitor comes back (see `WebApp(store=...)`).
+    The snapshots are pickles: a store must only be shared with trusted servers.
+    """
+
+    ttl: float | None = None  # seconds before a snapshot expires (None: never)
+
+    @abstractmethod
+    def save(self, sid: str, data: bytes) -> None:
+        """Saves the snapshot of a session (replacing the previous one)."""
+
+    @abstractmethod
+    def load(self, sid: str) -> bytes | None:
+        """The snapshot of a session, None if there's none."""
+
+    @abstractmethod
+    def delete(self, sid: str) -> None:
+        """Deletes the snapshot of a session (if any)."""
+
+    def purge(self) -> int:
+        """Deletes the expired snapshots (run by the eviction sweeper), returns their number."""
+        return 0
+
+
+class MemoryStore(SessionStore):
+    """
+    Keeps the snapshots in memory (compact bytes instead of live App instances).
+    The snapshots expire after `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float | None = None) -> None:
+        self.ttl = ttl
+        self.data: dict[str, tuple[bytes, float]] = {}
+
+    def save(self, sid: str, data: bytes) -> None:
+        self.data[sid] = (data, time.time())
+
+    def load(self, sid: str) -> bytes | None:
+        entry = self.data.get(sid)
+        if entry is None or (self.ttl is not None and entry[1] < time.time() - self.ttl):
+            return None
+        return entry[0]
+
+    def delete(self, sid: str) -> None:
+        self.data.pop(sid, None)
+
+    def purge(self) -> int:
+        if self.ttl is None:
+            return 0
+        limit = time.time() - self.ttl
+        expired = [sid for sid, (_, saved) in list(self.data.items()) if saved < limit]
+        for sid in expired:
+            self.data.pop(sid, None)
+        return len(expired)
+
+
+class SQLiteStore(SessionStore):
+    """
+    Keeps the snapshots in a SQLite database file (survives restarts).
+    The snapshots expire after `ttl` seconds.
+    """
+
+    def __init__(self, path: str, ttl: float | None = None) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS htag_sessions"
+                " (sid TEXT PRIMARY KEY, data BLOB NOT NULL, saved REAL NOT NULL)"
+            )
+
+    def save(self, sid: str, data: bytes) -> None:
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO htag_sessions (sid, data, saved) VALUES (?, ?, ?)",
+                (sid, data, time.time()),
+            )
+
+    def load(self, sid: str) -> bytes | None:
+        limit = time.time() - self.ttl if self.ttl is not None else float("-inf")
+        with self._lock:
+            row = self.db.execute(
+                "SELECT data FROM htag_sessions WHERE sid = ? AND saved >= ?", (sid, limit)
+            ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, sid: str) -> None:
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM htag_sessions WHERE sid = ?", (sid,))
+
+    def purge(self, max_age: float | None = None) -> int:
+        """Deletes the snapshots saved more than `max_age` (default: `ttl`) seconds ago, returns their number."""
+        if max_age is None:
+            max_age = self.ttl
+        if max_age is None:
+            return 0
+        with self._lock, self.db:
+            cursor = self.db.execute("DELETE FROM htag_sessions WHERE saved < ?", (time.time() - max_age,))
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class RedisError(Exception):
+    """An error reply of a Redis server."""
+
+
+class RedisStore(SessionStore):
+    """
+    Keeps the snapshots in a Redis (or compatible: Valkey, KeyDB, ...) server, spoken to
+    with a minimal RESP client (no dependency). The snapshots expire after `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: str | None = None,
+        prefix: str = "htag:",
+        ttl: int | None = None,
+        timeout: float = 5.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: socket.socket | None = None
+        self._buffer = b""
+
+    def save(self, sid: str, data: bytes) -> None:
+        if self.ttl:
+            self.command("SET", self.prefix + sid, data, "EX", self.ttl)
+        else:
+            self.command("SET", self.prefix + sid, data)
+
+    def load(self, sid: str) -> bytes | None:
+        return self.command("GET", self.prefix + sid)
+
+    def delete(self, sid: str) -> None:
+        self.command("DEL", self.prefix + sid)
+
+    def command(self, *args: Any) -> Any:
+        """Sends a command, returns its reply (reconnects once if the connection was lost)."""
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except OSError:
+                    self.close()
+                    if attempt == 2:
+                        raise
+
+    def close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._buffer = b""
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.password is not None:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+
+    def _call(self, *args: Any) -> Any:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            value = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(value), value))
+        assert self._sock is not None
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self._read_line()
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            return None if size < 0 else self._read_exactly(size + 2)[:-2]
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [self._read_reply() for _ in range(size)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _read_line(self) -> bytes:
+        while b"\r\n" not in self._buffer:
+            self._fill()
+        line, self._buffer = self._buffer.split(b"\r\n", 1)
+        return line
+
+    def _read_exactly(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            self._fill()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _fill(self) -> None:
+        assert self._sock is not None
+        chunk = self._sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("Connection closed by the Redis server")
+        self._buffer += chunk
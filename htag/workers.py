@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger("htag")
+
+# Headers of a hop (front dispatcher <-> client), not forwarded to the workers
+HOP_HEADERS: set[bytes] = {b"connection", b"keep-alive"}
+
+
+def worker_for(sid: str, workers: int) -> int:
+    """
+    The worker of a session: rendezvous hashing of its sid (stable, evenly spread, and
+    only the sessions of a removed worker would move).
+    """
+    return max(
+        range(workers),
+        key=lambda i: hashlib.blake2b(f"{i}:{sid}".encode(), digest_size=8).digest(),
+    )
+
+
+class Dispatcher:
+    """
+    The front of the workers: a TCP proxy which routes each connection to the worker of
+    its session (`worker_for` the htag_sid cookie of its request), whatever it is (page,
+    websocket, SSE stream, event). The requests without session are spread round-robin
+    (a worker creates sessions routed to itself). The HTTP requests are forwarded with
+    `Connection: close`, so a connection carries a single request (and can't mix sessions).
+    """
+
+    def __init__(self, ports: list[int], host: str = "127.0.0.1") -> None:
+        self.ports = ports
+        self.host = host
+        self._next = 0  # Worker of the next request without session
+
+    async def start(self, host: str, port: int) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port)
+
+    @staticmethod
+    def route(head: bytes) -> tuple[str, bytes]:
+        """Returns the session id of a request (its head), and the head to forward."""
+        lines = head.rstrip(b"\r\n").split(b"\r\n")
+        sid = ""
+        upgrade = False
+        headers: list[bytes] = []
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"cookie":
+                for pair in value.split(b";"):
+                    key, _, val = pair.strip().partition(b"=")
+                    if key == b"htag_sid":
+                        sid = val.decode("latin-1")
+            elif name == b"upgrade":
+                upgrade = True
+            headers.append(line)
+        if not upgrade:  # (a websocket needs its "Connection: Upgrade")
+            headers = [h for h in headers if h.partition(b":")[0].strip().lower() not in HOP_HEADERS]
+            headers.append(b"Connection: close")
+        return sid, b"\r\n".join([lines[0], *headers]) + b"\r\n\r\n"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        sid, head = self.route(head)
+        if sid:
+            port = self.ports[worker_for(sid, len(self.ports))]
+        else:
+            port = self.ports[self._next]
+            self._next = (self._next + 1) % len(self.ports)
+        try:
+            up_reader, up_writer = await asyncio.open_connection(self.host, port)
+        except OSError as e:
+            logger.error("Worker on port %d unreachable: %s", port, e)
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            writer.close()
+            return
+        up_writer.write(head)
+        try:
+            await asyncio.gather(self._pipe(reader, up_writer), self._pipe(up_reader, writer))
+        finally:
+            up_writer.close()
+            writer.close()
+
+    @staticmethod
+    async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Copies a direction of the connection, until its end (forwarded as a half-close)."""
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, OSError):
+            writer.close()  # (ends the other direction too)
+
+
+def free_ports(count: int) -> list[int]:
+    """Local ports free for the workers."""
+    sockets = [socket.socket() for _ in range(count)]
+    try:
+        for s in sockets:
+            s.bind(("127.0.0.1", 0))
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def run_workers(host: str, port: int, workers: int) -> None:
+    """
+    Re-runs the current script in `workers` processes (restarted if they die), each one
+    serving its sessions on a local port (see `WebApp.run`), behind a `Dispatcher`
+    listening on host:port.
+    """
+    ports = free_ports(workers)
+    cmd = [sys.executable] + sys.argv
+
+    def spawn(i: int) -> subprocess.Popen:
+        env = os.environ.copy()
+        env["HTAG_WORKER"] = str(i)
+        env["HTAG_WORKERS"] = str(workers)
+        env["HTAG_WORKER_PORT"] = str(ports[i])
+        logger.info("Starting worker %d on port %d", i, ports[i])
+        return subprocess.Popen(cmd, env=env)
+
+    processes = [spawn(i) for i in range(workers)]
+
+    async def serve() -> None:
+        server = await Dispatcher(ports).start(host, port)
+        logger.info("Dispatching to %d workers on http://%s:%d", workers, host, port)
+        async with server:
+            while True:
+                await asyncio.sleep(1)
+                for i, process in enumerate(processes):
+                    if process.poll() is not None:
+                        logger.warning("Worker %d exited (%s), restarting it", i, process.returncode)
+                        processes[i] = spawn(i)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        logger.info("KeyboardInterrupt, stopping the workers...")
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + 5
+        for process in processes:
+            try:
+                process.wait(timeout=max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
@@ -1,4 +1,5 @@
-from htag.core import GTag, Tag, prevent, stop, State
+import pytest
+from htag.core import GTag, Tag, prevent, stop, State, Computed, StateList, StateDict, For
 
 def test_gtag_init():
     t = Tag.div("hello")
@@ -66,6 +67,12 @@ def test_gtag_render_attrs():
     assert 'data-id="123"' in rendered
     assert f'id="{t.id}"' in rendered
 
+    # True is a bare attribute, "" an empty value, False/None omit it
+    t = Tag.input(_disabled=True, _value="", _checked=False, _title=None)
+    rendered = t._render_attrs()
+    assert rendered.startswith(' disabled value="" ')
+    assert "checked" not in rendered and "title" not in rendered
+
 def test_gtag_events():
     def my_handler(e): pass
     t = Tag.button(_onclick=my_handler, _onmouseover="alert(1)")
@@ -265,6 +272,349 @@ def test_gtag_reactive_state():
     assert t._GTag__dirty is True
     assert str(t) == f'<div id="{t.id}">Count: 1</div>'
 
+def test_gtag_render_cache():
+    s = State(0)
+    calls = []
+    def count():
+        calls.append(1)
+        return s.value
+
+    inner = Tag.span(count)
+    outer = Tag.div(inner, Tag.b("static"))
+    for t in outer._iter_tree():
+        t._reset_dirty()  # as done by the App when rendering
+
+    html1 = str(outer)
+    assert str(outer) is html1
+    assert len(calls) == 1
+
+    # Re-rendering the parent splices the cached child
+    outer._class = "x"
+    outer._reset_dirty()
+    assert 'class="x"' in str(outer)
+    assert len(calls) == 1
+
+    # A State change invalidates the observer and its ancestors
+    s.value = 1
+    inner._reset_dirty()
+    assert "<span" in str(outer) and ">1</span>" in str(outer)
+    assert len(calls) == 2
+
+    # Input sync (no dirty flag) invalidates too (the lambda result is memoized)
+    inner._set_attr_direct("value", "typed")
+    assert 'value="typed"' in str(outer)
+    assert len(calls) == 2
+
+    # A lambda reading no State is re-evaluated on every render
+    other = Tag.div(lambda: calls.append(1) or "plain")
+    other._reset_dirty()
+    str(other)
+    str(other)
+    assert len(calls) == 4
+
+def test_gtag_lambda_memoized_by_state_versions():
+    a = State(1)
+    b = State(10)
+    calls = []
+    def expensive():
+        calls.append(1)
+        return a.value + b.value
+
+    t = Tag.div(expensive)
+    assert ">11</div>" in str(t)
+
+    # An unrelated change re-renders the tag, but reuses the lambda result
+    t._class = "other"
+    assert 'class="other"' in str(t)
+    assert len(calls) == 1
+
+    # A dependency change (value or notify) re-evaluates it
+    b.value = 20
+    assert ">21</div>" in str(t)
+    a.notify()
+    str(t)
+    assert len(calls) == 3
+
+    # Removing the lambda forgets its memo
+    t.remove(expensive)
+    assert t._GTag__memo == {}
+
+def test_gtag_unsubscribes_states_no_more_read():
+    flag = State(True)
+    a = State("a")
+    b = State("b")
+    t = Tag.div(lambda: a.value if flag.value else b.value)
+    other = Tag.span(lambda: a.value)
+    t <= other
+    str(t)
+    assert t in a._observers and t not in b._observers
+
+    flag.value = False
+    str(t)
+    assert t not in a._observers and t in b._observers
+    assert other in a._observers
+
+    # A State read by another reactive child of the tag stays observed
+    t <= (lambda: b.value)
+    flag.value = True
+    str(t)
+    assert t in a._observers and t in b._observers
+
+    # Changes of a State no more read don't dirty the tag anymore
+    t.clear()
+    assert t not in a._observers and t not in b._observers and t not in flag._observers
+    t._reset_dirty()
+    a.value = "z"
+    assert not t.is_dirty
+
+def test_state_batch_coalesces_notifications(monkeypatch):
+    a = State(0)
+    b = State(0)
+    t = Tag.div(lambda: a.value + b.value)
+    u = Tag.span(lambda: b.value)
+    str(t), str(u)
+    marks = []
+    monkeypatch.setattr(GTag, "_mark_stale", lambda self: marks.append(self))
+
+    with State.batch():
+        for i in range(30):
+            a.value = i + 1
+        with State.batch():  # nested: deferred until the outermost batch exits
+            b.value = 1
+        assert marks == []
+        assert a.value == 30  # values are set immediately
+    assert sorted(marks, key=id) == sorted([t, u], key=id)
+
+    # As a decorator, and notifications are flushed even on errors
+    marks.clear()
+    @State.batch()
+    def tick():
+        a.value = 100
+        raise ValueError()
+    with pytest.raises(ValueError):
+        tick()
+    assert marks == [t]
+
+def test_computed_state():
+    rows = State([3, 1, 2])
+    limit = State(10)
+    calls = []
+    def sorted_rows():
+        calls.append(1)
+        return sorted(r for r in rows.value if r < limit.value)
+    view = Computed(sorted_rows)
+
+    # Lazy, and cached until an input changes
+    assert calls == []
+    assert view.value == [1, 2, 3]
+    assert view.value == [1, 2, 3]
+    assert len(calls) == 1
+    rows.value = [5, 4]
+    assert len(calls) == 1
+    assert view.value == [4, 5]
+    assert len(calls) == 2
+
+    # Observers are notified only when the derived value differs
+    t1 = Tag.div(lambda: len(view.value))
+    t2 = Tag.ul(lambda: [Tag.li(r) for r in view.value])
+    assert "<li" in str(t2) and ">2</div>" in str(t1)
+    assert len(calls) == 2  # computed once for all its observers
+    t1._reset_dirty(), t2._reset_dirty()
+    rows.value = [4, 5]
+    assert len(calls) == 3
+    assert not t1.is_dirty and not t2.is_dirty
+    limit.value = 5
+    assert t1.is_dirty and t2.is_dirty
+    assert ">1</div>" in str(t1)
+
+    with pytest.raises(AttributeError):
+        view.value = []
+
+def test_state_change_policies():
+    class Array:
+        """Elementwise comparisons, like NumPy arrays"""
+        def __init__(self, *items):
+            self.items = items
+        def __ne__(self, other):
+            return Array(*(a != b for a, b in zip(self.items, other.items)))
+        def __bool__(self):
+            raise ValueError("The truth value of an array is ambiguous")
+
+    s = State(Array(1, 2))
+    assert s.version == 0
+    s.value = Array(1, 2)  # ambiguous comparison: changed
+    assert s.version == 1
+    s.value = s.value  # same object: unchanged
+    assert s.version == 1
+
+    big = list(range(1000))
+    s = State(big, policy="identity")
+    s.value = list(big)
+    assert s.version == 1
+    s.value = s.value
+    assert s.version == 1
+    s.notify()
+    assert s.version == 2
+
+    s = State("Foo", policy=lambda old, new: old.lower() == new.lower())
+    s.value = "FOO"
+    assert s.version == 0 and s.value == "Foo"
+    s.value = "bar"
+    assert s.version == 1
+
+    with pytest.raises(ValueError):
+        State(0, policy="deep")
+
+def test_state_collections_log_operations():
+    items = StateList(["a", "b"])
+    t = Tag.div(lambda: ",".join(items))
+    assert ">a,b</div>" in str(t)
+    v = items.version
+    items.append("c")
+    items.insert(0, "z")
+    items.move(0, -1)
+    items[1] = "B"
+    items.pop(0)
+    items[0] = "B"  # unchanged: not logged
+    assert items.value == ["B", "c", "z"]
+    assert items.ops_since(v) == [
+        ("insert", 2, "c"),
+        ("insert", 0, "z"),
+        ("move", 0, 3),
+        ("set", 1, "B"),
+        ("remove", 0),
+    ]
+    assert items.ops_since(items.version) == []
+    assert t.is_dirty and ">B,c,z</div>" in str(t)
+
+    # Replacing the value (or notify) can't be described by the log
+    v = items.version
+    items.clear()
+    assert items.ops_since(v) is None and len(items) == 0
+
+    d = StateDict({"a": 1})
+    v = d.version
+    d["b"] = 2
+    d.update(a=1, c=3)
+    del d["b"]
+    assert d.ops_since(v) == [("set", "b", 2), ("set", "c", 3), ("remove", "b")]
+    assert dict(d.items()) == {"a": 1, "c": 3} and "c" in d
+
+def test_for_applies_state_list_operations():
+    items = StateList([{"id": i} for i in range(1000)])
+    rendered = []
+    def row(item):
+        rendered.append(item["id"])
+        return Tag.li(item["id"])
+    f = For(items, row, key=lambda item: item["id"])
+    rows = f()
+    assert f.changes is None and len(rendered) == 1000
+
+    # Appending renders one row, without iterating over the items
+    items.append({"id": 1000})
+    rows = f()
+    assert rendered[1000:] == [1000]
+    assert f.changes == [("insert", rows[-1], None)]
+
+    items.move(1000, 0)
+    items.pop(1)
+    rows = f()
+    moved, removed = f.changes
+    assert moved[:2] == ("move", rows[0]) and moved[2] is removed[1]  # placed before row 0...
+    assert removed[0] == "remove" and removed[1].childs == [0]  # ...then removed
+    assert [r.childs for r in rows[:2]] == [[1000], [1]]
+    assert len(rendered) == 1001
+
+    # Duplicate keys are still reported
+    items.append({"id": 5})
+    with pytest.raises(ValueError):
+        f()
+
+def test_for_diffs_the_keys_of_a_state():
+    import random
+    items = State(list(range(20)))
+    f = For(items, lambda i: Tag.li(i))
+    f()
+    assert f.changes is None
+    for _ in range(20):
+        new = random.sample(range(30), random.randint(1, 25))
+        dom = list(f._order)  # replay the changes on the previous keys
+        rows = {f._rows[k][1]: k for k in f._order}
+        items.value = new
+        result = f()
+        if f.changes is None:
+            assert not set(dom) & set(new)
+            continue
+        rows.update({row: k for k, (_, row) in f._rows.items()})
+        for kind, row, *before in f.changes:
+            if kind != "insert":
+                dom.remove(rows[row])
+            if kind != "remove":
+                dom.insert(dom.index(rows[before[0]]) if before[0] is not None else len(dom), rows[row])
+        assert dom == new and [r.childs for r in result] == [[i] for i in new]
+
+    # Only the rows out of order are moved
+    items.value = [1, 2, 3, 4]
+    f()
+    items.value = [1, 4, 3, 2]
+    f()
+    assert [c[0] for c in f.changes] == ["move", "move"]
+    items.value = [2, 1, 4, 3]  # (a rotation)
+    f()
+    assert [c[0] for c in f.changes] == ["move"]
+
+def test_gtag_render_deep_tree():
+    import sys
+    depth = sys.getrecursionlimit() * 2
+    top = node = Tag.div()
+    for i in range(depth):
+        child = Tag.div(lambda i=i: [Tag.b(i)] if i % 500 == 0 else None)
+        node.add(child)
+        node = child
+    node.add("leaf")
+
+    html = str(top)
+    assert html.count("<div") == depth + 1
+    assert html.count("</div>") == depth + 1
+    assert "leaf" in html
+    assert "<b" in html and ">0</b>" in html
+
+def test_for_keyed_rows():
+    items = State([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+    rendered = []
+    def row(item):
+        rendered.append(item["id"])
+        return Tag.li(item["name"])
+
+    ul = Tag.ul(For(items, row, key=lambda item: item["id"]))
+    html = str(ul)
+    assert ">a</li>" in html and ">b</li>" in html
+    rows = ul._get_rendered_callables()[ul.childs[0]]
+    assert rendered == [1, 2]
+
+    # Unchanged keys reuse their GTag; new/changed items are rendered
+    items.value = [{"id": 2, "name": "b"}, {"id": 3, "name": "c"}, {"id": 1, "name": "A"}]
+    html = str(ul)
+    assert rendered == [1, 2, 3, 1]
+    new_rows = ul._get_rendered_callables()[ul.childs[0]]
+    assert new_rows[0] is rows[1]
+    assert new_rows[2] is not rows[0]
+    assert html.index(">b</li>") < html.index(">c</li>") < html.index(">A</li>")
+
+    # Callable source, default key (the item itself)
+    letters = State(["x", "y"])
+    div = Tag.div(For(lambda: letters.value, lambda l: Tag.span(l)))
+    str(div)
+    first = div._get_rendered_callables()[div.childs[0]]
+    letters.value = ["y", "z"]
+    str(div)
+    assert div._get_rendered_callables()[div.childs[0]][0] is first[1]
+
+    # Duplicate keys are rejected
+    letters.value = ["x", "x"]
+    with pytest.raises(ValueError):
+        str(div)
+
 def test_gtag_reparenting_and_duplicates():
     p1 = Tag.div()
     p2 = Tag.section()
@@ -149,6 +149,7 @@ async def test_event_handler_error_reporting():
         async def send_text(self, text): self.sent.append(text)
     
     ws = MockWS()
+    app.websockets.add(ws)  # (connected)
     msg = {"id": app.btn.id, "event": "click", "data": {"callback_id": "123"}}
     await app.handle_event(msg, ws)
     
@@ -2,7 +2,7 @@ import pytest
 import asyncio
 import json
 from unittest.mock import MagicMock, AsyncMock
-from htag.server import Event, WebApp
+from htag.server import Event, WebApp, CLIENT_JS
 from htag import Tag
 
 App = Tag.App # Alias for tests
@@ -31,6 +31,40 @@ def test_app_find_tag():
     assert app.find_tag(app, child.id) == child
     assert app.find_tag(app, "nonexistent") is None
 
+def test_app_find_tag_index():
+    from htag import State
+    app = App()
+    box = Tag.div()
+    inner = Tag.span()
+    box <= inner
+    app <= box
+    assert app.find_tag(app, inner.id) is inner
+    assert app.find_tag(box, inner.id) is inner
+    assert app.find_tag(inner, box.id) is None
+
+    # Tags produced by reactive lambdas are indexed on render, and dropped on re-render
+    s = State("a")
+    box <= (lambda: Tag.b(s.value))
+    app.render_initial()
+    first = box._get_rendered_callables()[box.childs[-1]][0]
+    assert app.find_tag(app, first.id) is first
+    s.value = "b"
+    app.render_initial()
+    second = box._get_rendered_callables()[box.childs[-1]][0]
+    assert app.find_tag(app, second.id) is second
+    assert app.find_tag(app, first.id) is None
+
+    # Renamed ids are re-keyed
+    inner.id = "renamed"
+    assert app.find_tag(app, "renamed") is inner
+
+    # Detached subtrees are dropped
+    box.remove(inner)
+    assert app.find_tag(app, "renamed") is None
+    box.clear()
+    assert app.find_tag(app, box.id) is box
+    assert app.find_tag(app, second.id) is None
+
 def test_app_collect_statics():
     class Comp(Tag.div):
         statics = "/* css */"
@@ -44,6 +78,35 @@ def test_app_collect_statics():
     assert any("/* css */" in s for s in statics)
     assert any("body { color: red }" in s for s in statics)
 
+@pytest.mark.asyncio
+async def test_broadcast_updates_new_statics(monkeypatch):
+    class Comp(Tag.div):
+        statics = "/* comp */"
+
+    class Bold(Tag.b):
+        statics = ["/* comp */", "/* b */"]
+
+    app = App()
+    app += Comp()
+    app._render_page()
+    ws = AsyncMock()
+    app.websockets.add(ws)
+
+    # The statics are collected from the mounted subtrees only, never from the whole tree
+    monkeypatch.setattr(app, "collect_statics", MagicMock(side_effect=AssertionError))
+    app += Tag.div("plain")
+    app += Comp()
+    assert app._get_index().new_statics == []  # (already sent)
+    app += Tag.span(Bold())
+    await app.broadcast_updates()
+    data = json.loads(ws.send_text.call_args[0][0])
+    assert data["statics"] == ["/* b */"]
+
+    app.statics = ["/* b */", "/* app */"]  # (reassigned)
+    await app.broadcast_updates()
+    data = json.loads(ws.send_text.call_args[0][0])
+    assert data["statics"] == ["/* app */"]
+
 def test_app_collect_updates():
     app = App()
     child = Tag.div("initial")
@@ -64,6 +127,370 @@ def test_app_collect_updates():
     assert child.id in updates
     assert app.id not in updates
 
+def test_app_collect_updates_pending_registry():
+    from htag import State
+    app = App()
+    s = State(0)
+    label = Tag.span(lambda: s.value)
+    app <= Tag.div(label)
+    app.collect_updates(app, {}, [])
+    index = app._get_index()
+    assert len(index.pending) == 0
+
+    # State notification registers the observer only
+    s.value = 1
+    assert list(index.pending) == [label]
+    updates = {}
+    app.collect_updates(app, updates, [])
+    assert list(updates) == [label.id]
+    assert len(index.pending) == 0
+
+    # JS calls made while detached are picked up when mounted
+    orphan = Tag.div()
+    orphan.call_js("hello()")
+    assert len(index.pending) == 0
+    app <= orphan
+    js = []
+    app.collect_updates(app, {}, js)
+    assert js == ["hello()"]
+
+    # Detached tags are dropped from the registry
+    gone = Tag.div()
+    app <= gone
+    app.collect_updates(app, {}, [])
+    gone._class = "x"
+    app.remove(gone)
+    updates = {}
+    app.collect_updates(app, updates, [])
+    assert gone.id not in updates
+
+def test_app_collect_updates_prunes_nested_dirty_tags():
+    from htag import State
+    app = App()
+    s = State(0)
+    panel = Tag.div()
+    row = Tag.span("row")
+    panel <= row
+    panel <= (lambda: Tag.b(s.value))
+    app <= panel
+    app.collect_updates(app, {}, [])
+
+    # Parent and child both dirty: only the parent is rendered
+    row._class = "a"
+    panel._class = "b"
+    updates = {}
+    app.collect_updates(app, updates, [])
+    assert list(updates) == [panel.id]
+    assert not row.is_dirty
+
+    # Tags (re)created by a reactive lambda are not rendered a second time
+    s.value = 1
+    updates = {}
+    app.collect_updates(app, updates, [])
+    assert list(updates) == [panel.id]
+    bold = panel._get_rendered_callables()[panel.childs[-1]][0]
+    assert not bold.is_dirty
+    assert 'oninput' not in updates[panel.id]
+
+    # Inputs produced by reactive lambdas are auto-bound too
+    panel <= (lambda: Tag.input())
+    updates = {}
+    app.collect_updates(app, updates, [])
+    assert "oninput" in updates[panel.id]
+
+def test_app_collect_updates_regions():
+    from htag import State
+    app = App()
+    s = State(0)
+    static = Tag.p("big static content")
+    panel = Tag.div(static)
+    count = lambda: Tag.b(s.value)
+    panel <= count
+    app <= panel
+    html = app.render_initial()
+    app.collect_updates(app, {}, [])
+    rid = panel._region_id(count)
+    assert f"<!--htag:{rid}--><b" in html and f"</b><!--/htag:{rid}-->" in html
+
+    # A State change re-renders the region of the lambda only, not its owner
+    s.value = 1
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {}
+    assert len(ops) == 1
+    op, owner_id, region_id, content = ops[0]
+    assert (op, owner_id, region_id) == ("region", panel.id, rid)
+    assert content.startswith("<b") and ">1</b>" in content
+    assert "static" not in content
+    assert not panel.is_dirty
+    bold = panel._get_rendered_callables()[count][0]
+    assert app.find_tag(app, bold.id) is bold
+
+    # An attribute change of the owner is sent as a patch too
+    s.value = 2
+    panel._class = "x"
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {}
+    assert ops[0] == ["attrs", panel.id, {"class": "x"}]
+    assert ops[1][:3] == ["region", panel.id, rid] and ">2</b>" in ops[1][3]
+
+    # Without ops (legacy callers), the owner is rendered
+    s.value = 3
+    updates = {}
+    app.collect_updates(app, updates, [])
+    assert list(updates) == [panel.id]
+
+    # Detached renders have no markers
+    assert "<!--" not in str(Tag.div(lambda: s.value))
+
+def test_app_collect_updates_table_content():
+    from htag import State
+    app = App()
+    n = State(1)
+    table = Tag.table(lambda: [Tag.tr(Tag.td(i)) for i in range(n.value)])
+    body = Tag.tbody(lambda: [Tag.tr(Tag.td(i)) for i in range(n.value)])
+    app <= table
+    app <= Tag.table(body)
+    html = app.render_initial()
+    app.collect_updates(app, {}, [])
+    # No markers right in a table (the parser puts its rows in an implied tbody)
+    assert f'id="{table.id}"><tr' in html
+    assert f'id="{body.id}"><!--htag:' in html
+
+    n.value = 2
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    # The table is replaced, the rows of the tbody are a region
+    assert list(updates) == [table.id] and updates[table.id].count("<tr") == 2
+    assert [op[:2] for op in ops] == [["region", body.id]] and ops[0][3].count("<tr") == 2
+
+    # Same for a structural change
+    table <= Tag.tr(Tag.td("more"))
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert list(updates) == [table.id] and ops == []
+    assert ">more</td></tr></table>" in updates[table.id]
+
+def test_app_collect_updates_list_row_ops():
+    from htag import StateList, For
+    app = App()
+    messages = StateList(["hello"])
+    log = Tag.ul(For(messages, lambda m: Tag.li(m)))
+    app <= log
+    app.render_initial()
+    app.collect_updates(app, {}, [])
+    first = log._get_rendered_callables()[log.childs[0]][0]
+    rid = log._region_id(log.childs[0])
+
+    messages.append("world")
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {}
+    assert len(ops) == 1
+    op, parent_id, region_id, before, html = ops[0]
+    assert (op, parent_id, region_id, before) == ("insert", log.id, rid, None)
+    assert html.startswith("<li") and ">world</li>" in html
+
+    messages.insert(0, "first")
+    messages.move(2, 1)
+    messages.remove("hello")
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    rows = log._get_rendered_callables()[log.childs[0]]
+    assert [op[0] for op in ops] == ["insert", "move", "remove"]
+    assert ops[0][3] == first.id
+    assert ops[1][:2] == ["move", rows[1].id] and ops[1][4] == first.id
+    assert ops[2] == ["remove", first.id, log.id]
+    assert app.find_tag(app, first.id) is None
+
+    # A new list: the region is rendered
+    messages.value = ["reset"]
+    ops = []
+    app.collect_updates(app, {}, [], ops)
+    assert [op[0] for op in ops] == ["region"]
+
+def test_app_collect_updates_state_row_ops():
+    from htag import State, For
+    app = App()
+    users = State([{"id": i, "name": f"user{i}"} for i in range(1000)])
+    table = Tag.ul(For(users, lambda u: Tag.li(u["name"]), key=lambda u: u["id"]))
+    app <= table
+    app.render_initial()
+    app.collect_updates(app, {}, [])
+
+    # A new list with one more user: only its row is sent
+    users.value = users.value + [{"id": 1000, "name": "newcomer"}]
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {}
+    assert [op[0] for op in ops] == ["insert"]
+    assert ">newcomer</li>" in ops[0][4]
+    assert len(str(ops)) < 200
+
+    # A removed user, a renamed one, and the last one placed first
+    new = [dict(u) for u in users.value]
+    new[5]["name"] = "renamed"
+    del new[10]
+    new.insert(0, new.pop())
+    users.value = new
+    ops = []
+    app.collect_updates(app, {}, [], ops)
+    assert sorted(op[0] for op in ops) == ["insert", "move", "remove", "remove"]
+    assert len(str(ops)) < 500
+    rows = table._get_rendered_callables()[table.childs[0]]
+    assert [r.childs[0] for r in rows[:7]] == ["newcomer", "user0", "user1", "user2", "user3", "user4", "renamed"]
+
+def test_app_collect_updates_child_ops():
+    from htag.core import MAX_CHILD_OPS
+    app = App()
+    box = Tag.div([Tag.p(i) for i in range(100)])
+    other = Tag.div()
+    app <= box
+    app <= other
+    app.render_initial()
+    app.collect_updates(app, {}, [])
+
+    # Appending a child sends its HTML only
+    item = Tag.p("new")
+    box <= item
+    item._class = "fresh"  # changed before being sent: part of the insert
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {}
+    assert len(ops) == 1
+    assert ops[0][:4] == ["insert", box.id, None, None]
+    assert 'class="fresh"' in ops[0][4] and ">new</p>" in ops[0][4]
+
+    # Removing (or moving) a child
+    other <= item
+    box.remove(box.childs[0])
+    ops = []
+    app.collect_updates(app, {}, [], ops)
+    assert sorted(op[0] for op in ops) == ["insert", "remove", "remove"]
+    assert ["remove", item.id, box.id] in ops
+    assert any(op[0] == "insert" and op[1] == other.id for op in ops)
+
+    # A child added then removed is never sent
+    temp = Tag.span()
+    box <= temp
+    box.remove(temp)
+    other.text = "hello"
+    ops = []
+    app.collect_updates(app, {}, [], ops)
+    assert ops == [["text", other.id, "hello"]]
+    other.text = "<b>bold</b>"  # strings are HTML
+    ops = []
+    app.collect_updates(app, {}, [], ops)
+    assert ops == [["clear", other.id], ["insert", other.id, None, None, "<b>bold</b>"]]
+
+    # The children of a void element aren't rendered: nothing to send
+    field = Tag.input()
+    other <= field
+    app.collect_updates(app, {}, [], [])
+    field <= "ignored"
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {} and ops == []
+
+    # Too many changes: the tag is rendered as a whole
+    for i in range(MAX_CHILD_OPS + 1):
+        box <= Tag.b(i)
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert list(updates) == [box.id] and ops == []
+
+def test_app_collect_updates_attribute_ops():
+    from htag import State
+    app = App()
+    selected = State(False)
+    cell = Tag.td("content", _class="cell", _data_row=lambda: 1 if selected.value else None)
+    check = Tag.input(_type="checkbox")
+    app <= Tag.table(Tag.tr(cell, Tag.td(check)))
+    app.render_initial()
+    app.collect_updates(app, {}, [])
+
+    cell.toggle_class("hover")
+    selected.value = True
+    check._checked = True
+    check._onchange = lambda e: None
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {}
+    assert ["attrs", cell.id, {"class": "cell hover", "data-row": "1"}] in ops
+    assert ["attrs", check.id, {"checked": "", "onchange": f"htag_event('{check.id}', 'change', event)"}] in ops
+
+    check._checked = False
+    ops = []
+    app.collect_updates(app, {}, [], ops)
+    assert ops == [["attrs", check.id, {"checked": None}]]
+
+def test_app_collect_updates_diffs_full_renders():
+    from htag import State
+    app = App()
+    s = State(0)
+    field = Tag.input(_value="x")
+    label = Tag.span(lambda: s.value)
+    panel = Tag.div(Tag.p("static"), field, label)
+    app <= panel
+    app.render_initial()
+    app.collect_updates(app, {}, [])
+
+    # A full render of the panel is sent as the differences with the last sent one
+    panel._GTag__dirty = True
+    field._class = "error"
+    s.value = 5
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {}
+    assert ["attrs", field.id, {"class": "error"}] in ops
+    rid = label._region_id(label.childs[0])
+    assert ["region", label.id, rid, "5"] in ops
+    assert len(ops) == 2
+
+    # New content at the end is inserted
+    panel <= (lambda: Tag.b(s.value))
+    ops = []
+    app.collect_updates(app, {}, [], ops)
+    assert len(ops) == 1
+    assert ops[0][:4] == ["insert", panel.id, None, None]
+    assert ops[0][4].startswith("<!--htag:") and ">5</b>" in ops[0][4]
+
+    # Nothing changed: nothing is sent
+    other = Tag.div("x")
+    app <= other
+    app.collect_updates(app, {}, [], [])
+    other._GTag__dirty = True
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {} and ops == []
+
+    # Without a known previous render (it was patched), the tag is replaced
+    other.text = "y"
+    app.collect_updates(app, {}, [], [])
+    other._GTag__dirty = True
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert list(updates) == [other.id] and ops == []
+
+def test_app_collect_updates_diffs_deep_tree():
+    app = App()
+    top = node = Tag.div()
+    for _ in range(5000):
+        child = Tag.div()
+        node <= child
+        node = child
+    app <= top
+    app.render_initial()
+    app.collect_updates(app, {}, [])
+
+    top._GTag__dirty = True
+    node._class = "deepest"
+    updates, ops = {}, []
+    app.collect_updates(app, updates, [], ops)
+    assert updates == {}
+    assert ops == [["attrs", node.id, {"class": "deepest"}]]
+
 @pytest.mark.asyncio
 async def test_app_handle_event_sync():
     app = App()
@@ -144,6 +571,7 @@ async def test_app_handle_event_error():
     app += btn
     
     ws = AsyncMock()
+    app.websockets.add(ws)  # (connected)
     msg = {"id": btn.id, "event": "click", "data": {"callback_id": "error1"}}
     
     await app.handle_event(msg, ws)
@@ -164,6 +592,7 @@ async def test_app_handle_event_async_error():
     app += btn
     
     ws = AsyncMock()
+    app.websockets.add(ws)  # (connected)
     msg = {"id": btn.id, "event": "click", "data": {"callback_id": "error_async1"}}
     
     await app.handle_event(msg, ws)
@@ -196,12 +625,64 @@ async def test_app_handle_event_error_sse_fallback():
     assert "sse boom" in data["traceback"]
     assert data["callback_id"] == "error_sse1"
 
+@pytest.mark.asyncio
+async def test_app_render_initial_for_another_client():
+    from htag import State
+    app = App()
+    s = State(0)
+    label = Tag.span(lambda: s.value)
+    app <= label
+    app.render_initial()
+    app.collect_updates(app, {}, [])
+    first = asyncio.Queue()  # A connected client
+    app.sse_queues.add(first)
+
+    # Nothing changed: the render of another client is not sent to it
+    app.render_initial()
+    assert first.empty()
+
+    # A change not sent yet: the new render (the new baseline) is sent to it too
+    s.value = 1
+    html = app.render_initial()
+    assert "-->1<!--" in html
+    assert json.loads(first.get_nowait())["updates"] == {app.id: html}
+
+    # ... so the next differences apply to both clients
+    s.value = 2
+    await app.broadcast_updates()
+    ops = json.loads(first.get_nowait())["ops"]
+    assert [op[:2] for op in ops] == [["region", label.id]] and ops[0][3] == "2"
+
 def test_app_render_page():
     app = App()
     html = app._render_page()
     assert "<!DOCTYPE html>" in html
     assert app.__class__.__name__ in html
     assert app.id in html
+    assert "snapshots" not in html  # internal state, not an html attribute
+
+def test_app_morph_option():
+    assert "function htag_morph(" in CLIENT_JS
+    assert "window.HTAG_MORPH = false" in App()._render_page()
+
+    class MorphApp(App):
+        morph = True
+
+    assert "window.HTAG_MORPH = true" in MorphApp()._render_page()
+
+def test_app_iter_page_streams_head_first():
+    calls = []
+    app = App()
+    app <= (lambda: calls.append(1) or "body content")
+    chunks = app._iter_page()
+    head = next(chunks)
+    assert "<!DOCTYPE html>" in head
+    assert "htag_event" in head  # client bridge
+    assert calls == []  # the body isn't rendered yet
+    rest = "".join(chunks)
+    assert calls == [1]
+    assert "body content" in rest
+    assert app._render_page().count("</head>") == 1
 
 def test_app_render_page_error():
     app = App()
@@ -237,6 +718,174 @@ async def test_broadcast_updates():
     await app.broadcast_updates()
     assert ws2 not in app.websockets
 
+@pytest.mark.asyncio
+async def test_broadcast_updates_max_fps():
+    app = App()
+    app.max_fps = 5
+    ws = AsyncMock()
+    app.websockets.add(ws)
+
+    for i in range(5):  # e.g. the yields of a generator callback
+        app.call_js(f"step({i})")
+        await app.broadcast_updates()
+    assert ws.send_text.call_count == 1  # the others are merged into the next frame
+    assert app.next_frame is not None
+
+    await asyncio.sleep(0.25)
+    assert ws.send_text.call_count == 2
+    data = json.loads(ws.send_text.call_args[0][0])
+    assert data["js"] == ["step(1)", "step(2)", "step(3)", "step(4)"]
+
+    # A Promise is resolved at once, with the pending changes
+    app.call_js("step(5)")
+    await app.broadcast_updates()
+    await app.broadcast_updates(result=42, callback_id="cb1")
+    assert ws.send_text.call_count == 3
+    data = json.loads(ws.send_text.call_args[0][0])
+    assert data["js"] == ["step(5)"]
+    assert data["result"] == 42
+    assert app.next_frame is None
+
+@pytest.mark.asyncio
+async def test_auto_flush_of_background_changes():
+    import threading
+    from htag import State
+    app = App()
+    count = State(0)
+    app <= (lambda: f"count={count.value}")
+    app.render_initial()
+    app.collect_updates(app, {}, [])
+    ws = AsyncMock()
+    app.websockets.add(ws)
+    app.event_loop = asyncio.get_running_loop()  # as set by a connection
+
+    # Changes made by a thread (no event): pushed once, after the auto_flush delay
+    def work():
+        for i in range(1, 4):
+            count.value = i
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+    assert ws.send_text.call_count == 0
+    await asyncio.sleep(0.1)
+    assert ws.send_text.call_count == 1
+    data = json.loads(ws.send_text.call_args[0][0])
+    assert "count=3" in json.dumps(data["ops"])
+
+    # ... and by a background task
+    async def task():
+        app <= Tag.span("news")
+    await asyncio.create_task(task())
+    await asyncio.sleep(0.1)
+    assert ws.send_text.call_count == 2
+    assert "news" in ws.send_text.call_args[0][0]
+
+    # Disabled
+    app.auto_flush = None
+    count.value = 4
+    await asyncio.sleep(0.1)
+    assert ws.send_text.call_count == 2
+
+@pytest.mark.asyncio
+async def test_empty_flush_keeps_the_frame():
+    app = App()
+    app.max_fps = 5
+    app.render_initial()
+    ws = AsyncMock()
+    app.websockets.add(ws)
+    app.event_loop = asyncio.get_running_loop()
+
+    app.call_js("step(1)")
+    await app.broadcast_updates()  # (an event)
+    app.last_flush -= 1  # (a frame later)
+    last_flush = app.last_flush
+    await app._auto_flush()  # (its changes are already sent)
+    await app.broadcast_updates()
+    assert ws.send_text.call_count == 1
+    assert app.last_flush == last_flush
+
+    app.call_js("step(2)")  # Not delayed by the empty flushes
+    await app.broadcast_updates()
+    assert ws.send_text.call_count == 2
+    assert app.next_frame is None
+
+@pytest.mark.asyncio
+async def test_broadcast_updates_slow_client():
+    app = App()
+    app.max_queue = 2
+    app.render_initial()
+    async def stalled(payload):
+        await asyncio.Event().wait()
+    slow = AsyncMock()
+    slow.send_text.side_effect = stalled
+    fast = AsyncMock()
+    app.websockets.update({slow, fast})
+
+    for i in range(4):
+        app.call_js(f"step({i})")
+        await app.broadcast_updates(result=i, callback_id=f"cb{i}")
+    # The stalled client doesn't delay the other one
+    assert fast.send_text.call_count == 4
+    assert slow.send_text.call_count == 1
+
+    # The payloads waiting for the slow client were coalesced into the full state
+    queue = app.ws_writers[slow][0]
+    assert queue.qsize() == 1
+    data = json.loads(queue.get_nowait())
+    assert data["updates"] == {app.id: app.render_tag(app)}
+    assert data["js"] == ["step(1)", "step(2)", "step(3)"]
+    assert data["callbacks"] == {"cb1": 1, "cb2": 2, "cb3": 3}
+
+    # ... or it's disconnected
+    app.overflow = "disconnect"
+    for i in range(3):
+        await app.broadcast_updates(callback_id=f"cb{i}")
+    assert slow not in app.websockets and slow not in app.ws_writers
+    slow.close.assert_called_once()
+    assert fast in app.websockets
+
+    # The SSE queues are bounded too
+    sse = asyncio.Queue(maxsize=2)
+    app.sse_queues.add(sse)
+    for i in range(3):
+        await app.broadcast_updates(callback_id=f"cb{i}")
+    assert sse not in app.sse_queues
+    assert sse.get_nowait() is None  # ends the stream
+
+    # The error of an event goes through the queue of its client, after the waiting payloads
+    def fail(e):
+        raise ValueError("boom")
+    btn = Tag.button(_onclick=fail)
+    app <= btn
+    app.overflow = "coalesce"
+    app.websockets.add(slow)
+    await app.broadcast_updates(callback_id="before")
+    await app.handle_event({"id": btn.id, "event": "click", "data": {"callback_id": "err"}}, slow)
+    assert json.loads(slow.send_text.call_args[0][0])["callback_id"] == "before"  # (stalled)
+    queue = app.ws_writers[slow][0]
+    assert json.loads(queue.get_nowait())["callback_id"] == "err"
+
+    # ... where, too slow for it, the client is disconnected (as by a broadcast)
+    app.overflow = "disconnect"
+    event = {"id": btn.id, "event": "click", "data": {"callback_id": "err"}}
+    for i in range(2):
+        await app.broadcast_updates(callback_id=f"fill{i}")
+    await app.handle_event(event, slow)
+    assert slow not in app.websockets and slow not in app.ws_writers
+    await app.handle_event(event, slow)  # (its pending events: no writer for it again)
+    assert slow not in app.ws_writers
+    sse = asyncio.Queue(maxsize=1)
+    sse.put_nowait("waiting")
+    app.sse_queues.add(sse)
+    await app.handle_event(event, None)
+    assert sse not in app.sse_queues
+    assert sse.get_nowait() is None  # ends the stream
+
+    class Invalid(App):
+        overflow = "drop"
+    with pytest.raises(ValueError):
+        Invalid()
+
 @pytest.mark.asyncio
 async def test_broadcast_updates_render_error():
     app = App()
@@ -0,0 +1,272 @@
+import asyncio
+import socketserver
+import threading
+import time
+
+import pytest
+from starlette.requests import Request
+from starlette.testclient import TestClient
+
+from htag import Tag, State, StateList
+from htag.server import WebApp
+from htag.sessions import SessionStore, MemoryStore, SQLiteStore, RedisStore, RedisError
+
+
+class Counter(Tag.App):
+    def init(self):
+        self.count = State(0)
+        self.items = StateList()
+        self.panel = Tag.div(lambda: f"count={self.count.value}")
+        self.panel.color = State("red")
+        self <= self.panel
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """A local stand-in for a Redis server: speaks RESP, knows AUTH/SELECT/SET/GET/DEL."""
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            cmd = args[0].upper()
+            self.server.commands.append(args)
+            if cmd == b"AUTH":
+                reply = b"+OK\r\n" if args[1] == b"secret" else b"-ERR invalid password\r\n"
+            elif cmd in (b"SELECT", b"SET"):
+                if cmd == b"SET":
+                    data[args[1]] = args[2]
+                reply = b"+OK\r\n"
+            elif cmd == b"GET":
+                value = data.get(args[1])
+                reply = b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            elif cmd == b"DEL":
+                reply = b":%d\r\n" % (data.pop(args[1], None) is not None)
+            else:
+                reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+
+@pytest.fixture
+def redis_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data = {}
+    server.commands = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_app_snapshot_restore():
+    app = Counter()
+    app.count.value = 42
+    app.items.append("a")
+    app.panel.color.value = "blue"
+    data = app.snapshot()
+    assert isinstance(data, bytes)
+
+    other = Counter()
+    other.restore(data)
+    assert other.count.value == 42
+    assert list(other.items) == ["a"]
+    assert other.panel.color.value == "blue"
+    assert "count=42" in other.render_tag(other)
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+    class Partial(SessionStore):
+        def save(self, sid, data):
+            pass
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_memory_store():
+    store = MemoryStore()
+    assert store.load("sid") is None
+    store.save("sid", b"data")
+    assert store.load("sid") == b"data"
+    store.delete("sid")
+    assert store.load("sid") is None
+    assert store.purge() == 0
+
+
+def test_memory_store_ttl():
+    store = MemoryStore(ttl=60)
+    store.save("old", b"data")
+    store.save("new", b"data")
+    store.data["old"] = (b"data", time.time() - 120)
+    assert store.load("old") is None
+    assert store.load("new") == b"data"
+    assert store.purge() == 1
+    assert list(store.data) == ["new"]
+
+
+def test_sqlite_store(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteStore(path)
+    store.save("sid", b"data")
+    store.save("sid", b"data2")
+    store.close()
+
+    store = SQLiteStore(path)  # survives a restart
+    assert store.load("sid") == b"data2"
+    assert store.purge(3600) == 0
+    assert store.purge(-1) == 1
+    assert store.load("sid") is None
+    assert store.purge() == 0  # (no ttl)
+
+
+def test_sqlite_store_ttl(tmp_path, monkeypatch):
+    store = SQLiteStore(str(tmp_path / "sessions.db"), ttl=60)
+    store.save("sid", b"data")
+    assert store.load("sid") == b"data"
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert store.load("sid") is None
+    assert store.purge() == 1
+
+
+def test_redis_store(redis_server):
+    port = redis_server.server_address[1]
+    store = RedisStore(port=port, password="secret", db=2, prefix="app:", ttl=60)
+    store.save("sid", b"\x00binary\r\ndata")
+    assert redis_server.data[b"app:sid"] == b"\x00binary\r\ndata"
+    assert store.load("sid") == b"\x00binary\r\ndata"
+    store.delete("sid")
+    assert store.load("sid") is None
+    assert redis_server.commands[0] == [b"AUTH", b"secret"]
+    assert redis_server.commands[1] == [b"SELECT", b"2"]
+    assert redis_server.commands[2][3:] == [b"EX", b"60"]
+
+    # Reconnects when the connection was lost
+    store._sock.close()
+    store.save("sid", b"again")
+    assert store.load("sid") == b"again"
+
+    with pytest.raises(RedisError):
+        RedisStore(port=port, password="wrong").load("sid")
+
+
+def test_webapp_store(redis_server):
+    store = RedisStore(port=redis_server.server_address[1])
+    server = WebApp(Counter, max_sessions=1, store=store)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+
+    a = server._get_instance("a", mock_req)
+    a.count.value = 7
+    server._get_instance("b", mock_req)  # "a" is evicted, and saved
+    assert list(server.instances) == ["b"]
+    assert store.load("a") is not None
+
+    restored = server._get_instance("a", mock_req)  # ... and restored
+    assert restored is not a
+    assert restored.count.value == 7
+    assert store.load("a") is None  # (it's in memory again)
+    assert server._get_instance("c", mock_req).count.value == 0  # a new session
+
+
+@pytest.mark.asyncio
+async def test_webapp_store_saves_in_a_thread():
+    loop_thread = threading.get_ident()
+    release = threading.Event()
+
+    class SlowStore(MemoryStore):
+        def save(self, sid, data):
+            release.wait(5)  # (slow I/O)
+            self.thread = threading.get_ident()
+            super().save(sid, data)
+
+    store = SlowStore()
+    server = WebApp(Counter, store=store)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+    a = await server._aget_instance("a", mock_req)
+    a.count.value = 7
+    server.evict("a")  # Doesn't block the loop...
+    assert store.load("a") is None
+
+    # ... and a returning visitor waits for the save, to get its snapshot back
+    restoring = asyncio.ensure_future(server._aget_instance("a", mock_req))
+    await asyncio.sleep(0.05)
+    assert not restoring.done()
+    release.set()
+    restored = await restoring
+    assert restored.count.value == 7
+    assert store.thread != loop_thread
+    assert server._saving == {}
+    assert store.load("a") is None  # (it's in memory again)
+
+
+@pytest.mark.asyncio
+async def test_webapp_store_saves_the_state_before_unmount():
+    class Unmounting(Counter):
+        def on_unmount(self):
+            self.count.value = -1
+
+    store = MemoryStore()
+    server = WebApp(Unmounting, store=store)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+    a = await server._aget_instance("a", mock_req)
+    a.count.value = 7
+    server.evict("a")
+    assert a.count.value == -1
+    restored = await server._aget_instance("a", mock_req)
+    assert restored.count.value == 7
+
+
+@pytest.mark.asyncio
+async def test_webapp_store_loads_in_a_thread():
+    loads = []
+
+    class RecordingStore(MemoryStore):
+        def load(self, sid):
+            loads.append((sid, threading.get_ident()))
+            return super().load(sid)
+
+    store = RecordingStore()
+    server = WebApp(Counter, store=store)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+    await server._aget_instance("a", mock_req)
+    assert loads == [("a", loads[0][1])] and loads[0][1] != threading.get_ident()
+
+    # A sid just generated has no snapshot to look for
+    await server._aget_instance("b", mock_req, fresh=True)
+    assert len(loads) == 1
+    assert TestClient(server.app).get("/").status_code == 200
+    assert len(loads) == 1
+
+
+@pytest.mark.asyncio
+async def test_webapp_sweeper_purges_the_store(monkeypatch):
+    store = MemoryStore(ttl=60)
+    store.data["old"] = (b"data", time.time() - 120)
+    server = WebApp(Counter, store=store)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+    await server._aget_instance("a", mock_req)
+    assert server._sweeper is not None  # (started for the store ttl)
+    server._sweeper.cancel()
+
+    sleep = asyncio.sleep
+    sleeps = []
+
+    async def fast_sleep(delay):
+        sleeps.append(delay)
+        if len(sleeps) > 1:
+            raise asyncio.CancelledError
+        await sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", fast_sleep)
+    with pytest.raises(asyncio.CancelledError):
+        await server._sweep_forever()
+    assert "old" not in store.data
@@ -136,3 +136,218 @@ def test_tag_request_attribute():
     asyncio.run(run_event())
     assert inst.event_request is not None
     assert inst.event_request.scope["type"] == "http"
+
+def test_session_eviction(monkeypatch):
+    """Verify the LRU cap and the idle TTL of the sessions, and the on_evict hook."""
+    unmounted = []
+    class Session(MyApp):
+        def on_unmount(self):
+            unmounted.append(self)
+
+    evicted = []
+    server = WebApp(Session, max_sessions=2, session_ttl=60, on_evict=lambda sid, inst: evicted.append(sid))
+    now = [1000.0]
+    monkeypatch.setattr("htag.server.time.monotonic", lambda: now[0])
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+
+    a = server._get_instance("a", mock_req)
+    server._get_instance("b", mock_req)
+    server._get_instance("a", mock_req)  # "b" is now the least recently used
+    server._get_instance("c", mock_req)
+    assert set(server.instances) == {"a", "c"}
+    assert evicted == ["b"]
+    assert len(unmounted) == 1
+
+    # A session with connected clients is kept, even idle
+    a.websockets.add(object())
+    now[0] += 61
+    assert server.sweep() == ["c"]
+    assert set(server.instances) == {"a"}
+
+    # ... and its idle time starts when it's disconnected
+    a.websockets.clear()
+    now[0] += 30
+    assert server.sweep() == []
+    now[0] += 31
+    assert server.sweep() == ["a"]
+    assert server.instances == {}
+    assert evicted == ["b", "c", "a"]
+
+def test_session_eviction_shared_instance():
+    """Verify that an evicted session doesn't unmount a shared instance."""
+    unmounted = []
+    class Shared(MyApp):
+        def on_unmount(self):
+            unmounted.append(self)
+
+    shared_app = Shared()
+    server = WebApp(shared_app, max_sessions=1)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+    server._get_instance("a", mock_req)
+    assert server._get_instance("b", mock_req) is shared_app
+    assert list(server.instances) == ["b"]
+    assert unmounted == []
+
+def test_lazy_sessions():
+    """Verify that the visitors without session get a shared shell page, without session."""
+    created = []
+    class Lazy(MyApp):
+        statics = [Tag.style("body { color: red; }")]
+        def init(self):
+            created.append(self)
+            self <= Tag.h1("Hello")
+
+    server = WebApp(Lazy, lazy_sessions=True)
+    client = TestClient(server.app)
+    res = client.get("/")
+    assert res.status_code == 200
+    assert "htag_sid" not in res.cookies
+    assert "public" in res.headers["cache-control"]
+    assert "window.HTAG_SHELL = true" in res.text
+    assert "Hello" in res.text and "color: red" in res.text
+    assert server.instances == {}
+
+    # The shell is rendered once
+    assert client.get("/").text == res.text
+    assert len(created) == 1
+
+    # The session is created when its client connects (with the sid it picked)
+    client.cookies.set("htag_sid", "picked-by-the-client")
+    with client.websocket_connect("/ws") as websocket:
+        data = websocket.receive_json()
+        inst = server.instances["picked-by-the-client"]
+        assert data["updates"] == {inst.id: inst.render_tag(inst)}
+    assert len(created) == 2
+    assert "body { color: red; }" in "".join(inst.sent_statics)  # loaded by the shell
+
+    # A visitor with a session gets its page
+    res = client.get("/")
+    assert "window.HTAG_SHELL = false" in res.text
+    assert inst.id in res.text
+
+def test_evicted_session_reconnects():
+    """Verify that the open page of an evicted session gets the body of its new session."""
+    server = WebApp(MyApp)
+    client = TestClient(server.app)
+    res = client.get("/")
+    sid = res.cookies["htag_sid"]
+    old = server.instances[sid]
+    assert old.id in res.text
+
+    server.evict(sid)
+    with client.websocket_connect("/ws") as websocket:
+        data = websocket.receive_json()
+    new = server.instances[sid]
+    assert new is not old
+    # The initial update of the connection: the client puts it in place of its body
+    assert data["init"] is True
+    assert data["updates"] == {new.id: new.render_tag(new)}
+    assert "data.init)) el = document.body" in res.text
+
+def test_instance_creation_locks():
+    """Verify that a slow session creation doesn't block the creation of the other ones."""
+    import threading
+    gate = threading.Event()
+    created = []
+    class Slow(MyApp):
+        def init(self):
+            if threading.current_thread().name.startswith("slow"):
+                assert gate.wait(5)
+            created.append(self)
+
+    server = WebApp(Slow)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+    results = []
+    slow = [
+        threading.Thread(target=lambda: results.append(server._get_instance("s1", mock_req)), name=f"slow{i}")
+        for i in range(2)
+    ]
+    for t in slow:
+        t.start()
+    fast = server._get_instance("s2", mock_req)  # not blocked by the creation of "s1"
+    assert "s1" not in server.instances  # (available once fully created)
+    gate.set()
+    for t in slow:
+        t.join()
+    assert results[0] is results[1] is server.instances["s1"]  # created once
+    assert len(created) == 2 and fast in created
+
+def test_instance_creation_failure():
+    """Verify that the requests waiting for a failed creation fail too, without creating it again."""
+    import threading
+    gate = threading.Event()
+    attempts = []
+    class Failing(MyApp):
+        def init(self):
+            attempts.append(self)
+            assert gate.wait(5)
+            raise RuntimeError("no database")
+
+    server = WebApp(Failing)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+    errors = []
+    def request():
+        try:
+            server._get_instance("s", mock_req)
+        except RuntimeError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for t in threads:
+        t.start()
+    while not attempts or server._creating["s"][1] < 3:  # (all waiting)
+        threading.Event().wait(0.01)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(attempts) == 1 and len(errors) == 3
+    assert server.instances == {} and server._creating == {}
+
+    # A later request tries again
+    with pytest.raises(RuntimeError):
+        server._get_instance("s", mock_req)
+    assert len(attempts) == 2
+
+def test_on_instance_introspected_once(monkeypatch):
+    """Verify that the signature of on_instance is introspected once."""
+    import inspect
+    calls = []
+    signature = inspect.signature
+    monkeypatch.setattr("htag.server.inspect.signature", lambda fn: calls.append(fn) or signature(fn))
+    seen = []
+    server = WebApp(MyApp, on_instance=lambda inst, req: seen.append(req))
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+    for sid in ("a", "b", "c"):
+        server._get_instance(sid, mock_req)
+    assert len(seen) == 3
+    assert len(calls) == 1
+
+def test_threaded_init():
+    """Verify that, with threaded_init, the sessions are created out of the event loop."""
+    import asyncio
+    import threading
+    threads = []
+    class Slow(MyApp):
+        def init(self):
+            threads.append(threading.current_thread())
+            import time
+            time.sleep(0.2)
+
+    server = WebApp(Slow, threaded_init=True)
+    mock_req = Request(scope={"type": "http", "headers": [], "path": "/"})
+
+    async def main():
+        ticks = []
+        async def ticker():
+            for _ in range(5):
+                ticks.append("a" in server.instances)
+                await asyncio.sleep(0.02)
+        a, b, _ = await asyncio.gather(
+            server._aget_instance("a", mock_req), server._aget_instance("a", mock_req), ticker()
+        )
+        return a, b, ticks
+
+    a, b, ticks = asyncio.run(main())
+    assert a is b is server.instances["a"]
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    assert ticks == [False] * 5  # the loop wasn't blocked during the creation
+    assert server._creations == {}
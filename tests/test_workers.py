@@ -0,0 +1,107 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from htag import Tag
+from htag.server import WebApp
+from htag.workers import Dispatcher, worker_for
+
+
+class MyApp(Tag.App):
+    pass
+
+
+def test_worker_for():
+    sids = [f"sid-{i}" for i in range(1000)]
+    assignment = [worker_for(sid, 4) for sid in sids]
+    assert assignment == [worker_for(sid, 4) for sid in sids]  # stable
+    assert all(assignment.count(i) > 150 for i in range(4))  # spread
+    # Adding a worker only moves sessions to the new one
+    for sid, before in zip(sids, assignment):
+        assert worker_for(sid, 5) in (before, 4)
+
+
+def test_dispatcher_route():
+    head = (
+        b"GET /stream HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n"
+        b"Cookie: theme=dark; htag_sid=abc-123\r\n\r\n"
+    )
+    sid, forwarded = Dispatcher.route(head)
+    assert sid == "abc-123"
+    assert forwarded == (
+        b"GET /stream HTTP/1.1\r\nHost: x\r\nCookie: theme=dark; htag_sid=abc-123\r\n"
+        b"Connection: close\r\n\r\n"
+    )
+
+    # A websocket keeps its upgrade headers
+    head = b"GET /ws HTTP/1.1\r\nConnection: Upgrade\r\nUpgrade: websocket\r\n\r\n"
+    assert Dispatcher.route(head) == ("", head)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_forwarding():
+    heads = [[], []]
+
+    def upstream(i):
+        async def handle(reader, writer):
+            heads[i].append(await reader.readuntil(b"\r\n\r\n"))
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 8\r\n\r\nworker-%d" % i)
+            await writer.drain()
+            writer.close()
+        return handle
+
+    servers = [await asyncio.start_server(upstream(i), "127.0.0.1", 0) for i in range(2)]
+    ports = [s.sockets[0].getsockname()[1] for s in servers]
+    front = await Dispatcher(ports).start("127.0.0.1", 0)
+    front_port = front.sockets[0].getsockname()[1]
+
+    async def request(sid):
+        reader, writer = await asyncio.open_connection("127.0.0.1", front_port)
+        writer.write(b"GET / HTTP/1.1\r\nHost: x\r\nCookie: htag_sid=%s\r\n\r\n" % sid.encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    for sid in ("a", "b", "c", "d"):
+        response = await request(sid)
+        assert response.endswith(b"worker-%d" % worker_for(sid, 2))
+    assert sum(map(len, heads)) == 4
+
+    # The requests without session are spread
+    before = [len(h) for h in heads]
+    for _ in range(4):
+        reader, writer = await asyncio.open_connection("127.0.0.1", front_port)
+        writer.write(b"GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+        await reader.read()
+        writer.close()
+    assert [len(h) for h in heads] == [n + 2 for n in before]
+    assert all(b"Connection: close" in head for head in heads[0] + heads[1])
+
+    for s in servers + [front]:
+        s.close()
+        await s.wait_closed()
+
+
+def test_webapp_worker(monkeypatch):
+    monkeypatch.setenv("HTAG_WORKER", "1")
+    monkeypatch.setenv("HTAG_WORKERS", "3")
+    monkeypatch.setenv("HTAG_WORKER_PORT", "9123")
+    server = WebApp(MyApp)
+    assert server.worker == (1, 3)
+    # The new sessions of a worker are the ones routed to it
+    assert all(worker_for(server._new_sid(), 3) == 1 for _ in range(20))
+
+    with patch("uvicorn.run") as mock_run:
+        server.run(workers=3)
+    mock_run.assert_called_once_with(server.app, host="127.0.0.1", port=9123)
+
+
+def test_webapp_run(monkeypatch):
+    monkeypatch.delenv("HTAG_WORKER", raising=False)
+    server = WebApp(MyApp)
+    with patch("uvicorn.run") as mock_run, patch("htag.server.run_workers") as mock_workers:
+        server.run(port=8080)
+        mock_run.assert_called_once_with(server.app, host="127.0.0.1", port=8080)
+        server.run("0.0.0.0", 80, workers=4)
+        mock_workers.assert_called_once_with("0.0.0.0", 80, 4)